@@ -15,29 +15,36 @@ from . import marko
 from . import jinja2
 from .markdown.core import logger
 import traceback
-import time
 import html
 import html.parser
 import sys
-import urllib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import functools
 import base64
+import hashlib
 from . import version as ver
 from . import colorbox
+from .cache import LRUCache, fragment_cache
 from importlib import import_module
 from collections import OrderedDict
-from .st_scheme_template import SchemeTemplate, POPUP, PHANTOM, SHEET
+from .st_scheme_template import (
+    SchemeTemplate, POPUP, PHANTOM, SHEET, clear_css_cache, get_css_disk_cache,
+    get_template_bytecode_cache, template_from_string
+)
 from .st_clean_css import clean_css
 from .st_pygments_highlight import syntax_hl as pyg_syntax_hl
-from .st_code_highlight import SublimeHighlight
+from .st_code_highlight import SublimeHighlight, scratch_views, syntax_index
 from .mdx.marko_highlight import make_extension
 from .mdx.marko_gfm import GFM
 from .st_mapping import lang_map
 from .coloraide import Color
 from . import imagetint
+from . import imagefetch
+from .imageindex import ImageIndex
 import re
 import os
-from . import frontmatter
+from . import frontmatter as _frontmatter
 try:
     import bs4
 except Exception:
@@ -60,6 +67,12 @@ there are helpful errors.</p></div>
 '''
 HL_SETTING = 'mdpopups.use_sublime_highlighter'
 STYLE_SETTING = 'mdpopups.default_style'
+HTML_CACHE_SETTINGS = (
+    HL_SETTING,
+    STYLE_SETTING,
+    'mdpopups.user_css',
+    'mdpopups.sublime_user_lang_map'
+)
 RE_BAD_ENTITIES = re.compile(r'(&(?!amp;|lt;|gt;|nbsp;)(?:\w+;|#\d+;))')
 
 NODEBUG = 0
@@ -122,38 +135,64 @@ else:
 ##############################
 # Theme/Scheme cache management
 ##############################
-_scheme_cache = OrderedDict()
-_highlighter_cache = OrderedDict()
+CACHE_LIMIT = 10
+CACHE_REFRESH_TIME = 30
+
+
+def _scheme_sizeof(value):
+    """Estimate the memory used by a scheme cache entry (the CSS it holds)."""
+
+    return len(value[1]) + len(value[2])
+
+
+_scheme_cache = LRUCache(CACHE_LIMIT, sizeof=_scheme_sizeof, ttl=CACHE_REFRESH_TIME * 60)
+_highlighter_cache = LRUCache(CACHE_LIMIT, ttl=CACHE_REFRESH_TIME * 60)
+_html_cache = LRUCache(50)
 
 
 def _clear_cache():
-    """Clear the CSS cache."""
+    """Clear the caches in memory."""
 
-    global _scheme_cache
-    global _highlighter_cache
-    _scheme_cache = OrderedDict()
-    _highlighter_cache = OrderedDict()
+    _scheme_cache.clear()
+    _highlighter_cache.clear()
+    _html_cache.clear()
+    fragment_cache.clear()
+    _frontmatter.frontmatter_cache.clear()
+    _template_envs.clear()
+    _template_cache.clear()
+    _clear_parser_pool()
+    scratch_views.clear()
+    syntax_index.clear()
+    clear_css_cache()
+    colorbox.box_cache.clear()
+    imagetint.tint_cache.clear()
+    _get_image_cache().clear_failures()
 
 
-def _is_cache_expired(cache_time):
-    """Check if the cache entry is expired."""
+def _purge_disk_cache():
+    """Delete the caches on disk."""
 
-    delta_time = _get_setting('mdpopups.cache_refresh_time', 30)
-    if not isinstance(delta_time, int) or delta_time < 0:
-        delta_time = 30
-    return delta_time == 0 or (time.time() - cache_time) >= (delta_time * 60)
+    get_css_disk_cache().clear()
+    get_template_bytecode_cache().clear()
+    _get_image_cache().clear()
 
 
-def _prune_cache():
-    """Prune older items in cache (related to when they were inserted)."""
+def _get_cache_limit(name):
+    """Get a cache limit setting."""
 
-    limit = _get_setting('mdpopups.cache_limit', 10)
+    limit = _get_setting(name, CACHE_LIMIT)
     if limit is None or not isinstance(limit, int) or limit <= 0:
-        limit = 10
-    while len(_scheme_cache) >= limit:
-        _scheme_cache.popitem(last=True)
-    while len(_highlighter_cache) >= limit:
-        _highlighter_cache.popitem(last=True)
+        limit = CACHE_LIMIT
+    return limit
+
+
+def _configure_cache(cache, limit_setting):
+    """Apply the limit and refresh time settings to a scheme or highlighter cache."""
+
+    delta_time = _get_setting('mdpopups.cache_refresh_time', CACHE_REFRESH_TIME)
+    if not isinstance(delta_time, int) or delta_time < 0:
+        delta_time = CACHE_REFRESH_TIME
+    cache.resize(_get_cache_limit(limit_setting), delta_time * 60)
 
 
 def _get_sublime_highlighter(view):
@@ -162,19 +201,18 @@ def _get_sublime_highlighter(view):
     scheme = view.settings().get('color_scheme')
     obj = None
     if scheme is not None:
-        if scheme in _highlighter_cache:
-            obj, t = _highlighter_cache[scheme]
-            if _is_cache_expired(t):
-                obj = None
+        _configure_cache(_highlighter_cache, 'mdpopups.highlighter_cache_limit')
+        obj = _highlighter_cache.get(scheme)
         if obj is None:
             try:
                 obj = SublimeHighlight(scheme)
-                _prune_cache()
-                _highlighter_cache[scheme] = (obj, time.time())
+                _highlighter_cache.set(scheme, obj)
             except Exception:
                 _log('Failed to get Sublime highlighter object!')
                 _debug(traceback.format_exc(), ERROR)
                 pass
+        if obj is not None:
+            obj.sync_style(view)
     return obj
 
 
@@ -186,11 +224,12 @@ def _get_scheme(scheme):
     user_css = ''
     default_css = ''
     if scheme is not None:
-        if scheme in _scheme_cache:
-            obj, user_css, default_css, t = _scheme_cache[scheme]
-            # Check if cache expired or user changed Pygments setting.
+        _configure_cache(_scheme_cache, 'mdpopups.cache_limit')
+        entry = _scheme_cache.get(scheme)
+        if entry is not None:
+            obj, user_css, default_css = entry
+            # Check if user changed Pygments setting.
             if (
-                _is_cache_expired(t) or
                 obj.use_pygments != (not settings.get(HL_SETTING, True)) or
                 obj.default_style != settings.get(STYLE_SETTING, True)
             ):
@@ -200,10 +239,11 @@ def _get_scheme(scheme):
         if obj is None:
             try:
                 obj = SchemeTemplate(scheme)
-                _prune_cache()
+                # Rendered HTML may reference the old scheme colors.
+                _html_cache.clear()
                 user_css = _get_user_css()
                 default_css = _get_default_css()
-                _scheme_cache[scheme] = (obj, user_css, default_css, time.time())
+                _scheme_cache.set(scheme, (obj, user_css, default_css))
             except Exception:
                 _log('Failed to convert/retrieve scheme to CSS!')
                 _debug(traceback.format_exc(), ERROR)
@@ -388,6 +428,19 @@ class _MarkoWrapper(marko.Markdown):
             pass
         super().__init__(*args, **kwargs)
 
+    def reset(self):
+        """
+        Reset state between conversions.
+
+        Each parse creates a new document, which holds the link reference definitions and footnote definitions,
+        but the renderer and its extension mixins keep their own state (such as the referenced footnotes) on the
+        instance, so it is replaced with a new one.
+        """
+
+        if self._setup_done:
+            self.renderer = type(self.renderer)()
+        return self
+
     def load_extension(self, name, **kwargs):
         """
         Load extension object from a string.
@@ -440,6 +493,101 @@ class _MarkoWrapper(marko.Markdown):
             self._extra_elements.extend(extension.elements)
 
 
+##############################
+# Markdown parser pool
+##############################
+PARSER_POOL_LIMIT = 10
+PARSER_POOL_DEPTH = 2
+_parser_pool = OrderedDict()
+_parser_pool_lock = threading.Lock()
+
+
+def _freeze(obj):
+    """
+    Convert a frontmatter derived object into a hashable equivalent.
+
+    Values are paired with their type, as `1`, `True`, and `1.0` are equal but configure parsers differently.
+    """
+
+    if isinstance(obj, (dict, OrderedDict)):
+        return ('dict', tuple((_freeze(k), _freeze(v)) for k, v in obj.items()))
+    elif isinstance(obj, (list, tuple)):
+        return ('list', tuple(_freeze(v) for v in obj))
+    elif isinstance(obj, set):
+        return ('set', frozenset(_freeze(v) for v in obj))
+    return (type(obj), obj)
+
+
+def _parser_key(*args):
+    """
+    Create a parser pool key from the given parser options.
+
+    If the options cannot be hashed (some custom object was passed in),
+    `None` is returned and the parser will not be pooled.
+    """
+
+    key = _freeze(args)
+    try:
+        hash(key)
+    except TypeError:
+        key = None
+    return key
+
+
+def _clear_parser_pool():
+    """Clear the parser pool."""
+
+    with _parser_pool_lock:
+        _parser_pool.clear()
+
+
+def _checkout_parser(key, factory):
+    """
+    Get an idle parser for the given key or create a new one.
+
+    A parser that is checked out is owned by the calling thread
+    until it is returned via `_checkin_parser`.
+    """
+
+    if key is not None:
+        with _parser_pool_lock:
+            idle = _parser_pool.get(key)
+            if idle:
+                _parser_pool.move_to_end(key)
+                return idle.pop()
+    return factory()
+
+
+def _checkin_parser(key, parser):
+    """Reset the parser and return it to the pool."""
+
+    if key is None:
+        return
+
+    parser.reset()
+    with _parser_pool_lock:
+        idle = _parser_pool.get(key)
+        if idle is None:
+            idle = []
+            _parser_pool[key] = idle
+            while len(_parser_pool) > PARSER_POOL_LIMIT:
+                _parser_pool.popitem(last=False)
+        else:
+            _parser_pool.move_to_end(key)
+        if len(idle) < PARSER_POOL_DEPTH:
+            idle.append(parser)
+
+
+def _pooled_convert(key, factory, text):
+    """Convert the text with a pooled parser."""
+
+    parser = _checkout_parser(key, factory)
+    # If conversion fails, the parser is simply dropped as its state is unknown.
+    html = parser.convert(text)
+    _checkin_parser(key, parser)
+    return html
+
+
 def _get_theme(view, css=None, css_type=POPUP, template_vars=None):
     """Get the theme."""
 
@@ -469,12 +617,43 @@ def _remove_entities(text):
     return RE_BAD_ENTITIES.sub(repl, text)
 
 
+def _html_cache_key(
+    view, content, md, css, css_type, wrapper_class, template_vars, template_env_options, frontmatter
+):
+    """
+    Create a content hash of everything that affects the rendered HTML.
+
+    The scheme is resolved first, so an expired or changed scheme is rebuilt (clearing the HTML cache) before the
+    cache is consulted. The identity of the scheme object and the user CSS it was loaded with are part of the key.
+    """
+
+    settings = sublime.load_settings('Preferences.sublime-settings')
+    scheme = view.settings().get('color_scheme')
+    obj, user_css, default_css = _get_scheme(scheme)
+    key = repr(
+        (
+            content, bool(md), css, css_type, wrapper_class, template_vars, template_env_options, frontmatter,
+            scheme, id(obj), hashlib.sha1((user_css + default_css).encode('utf-8')).hexdigest(),
+            tuple(settings.get(name) for name in HTML_CACHE_SETTINGS)
+        )
+    )
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
 def _create_html(
     view, content, md=True, css=None, debug=False, css_type=POPUP,
-    wrapper_class=None, template_vars=None, template_env_options=None
+    wrapper_class=None, template_vars=None, template_env_options=None, cache=False, frontmatter=None
 ):
     """Create HTML from content."""
 
+    if cache:
+        key = _html_cache_key(
+            view, content, md, css, css_type, wrapper_class, template_vars, template_env_options, frontmatter
+        )
+        html = _html_cache.get(key)
+        if html is not None:
+            return html
+
     debug = _get_setting('mdpopups.debug', NODEBUG)
 
     if css is None or not isinstance(css, str):
@@ -489,12 +668,12 @@ def _create_html(
     if md:
         content = md2html(
             view, content, template_vars=template_vars,
-            template_env_options=template_env_options
+            template_env_options=template_env_options, frontmatter=frontmatter
         )
     else:
         # Strip out frontmatter if found as we don't currently
         # do anything with it when content is just HTML.
-        content = _markup_template(frontmatter.get_frontmatter(content)[1], template_vars, template_env_options)
+        content = _markup_template(_get_frontmatter(content)[1], template_vars, template_env_options)
 
     if debug:
         _debug('=====HTML OUTPUT=====', INFO)
@@ -511,17 +690,94 @@ def _create_html(
 
     html = "<style>{}</style>".format(style)
     html += _remove_entities(wrapper.format(content))
+
+    if cache:
+        limit = _get_setting('mdpopups.html_cache_limit', 50)
+        if not isinstance(limit, int) or limit < 0:
+            limit = 50
+        _html_cache.resize(limit)
+        _html_cache.set(key, html)
     return html
 
 
+##############################
+# Content templates
+##############################
+TEMPLATE_ENV_LIMIT = 10
+TEMPLATE_CACHE_LIMIT = 100
+_template_envs = LRUCache(TEMPLATE_ENV_LIMIT)
+_template_cache = LRUCache(TEMPLATE_CACHE_LIMIT)
+
+
+def _get_template(markup, options):
+    """
+    Get the compiled Jinja2 template for the markup.
+
+    Environments are cached by their options and templates by a hash of the markup.
+    If the options cannot be hashed, nothing is cached.
+    """
+
+    if options is None:
+        options = {}
+    env_key = _parser_key(options)
+    if env_key is None:
+        return jinja2.Environment(**options).from_string(markup)
+
+    key = (env_key, hashlib.sha1(markup.encode('utf-8')).hexdigest())
+    template = _template_cache.get(key)
+    if template is None:
+        env = _template_envs.get(env_key)
+        if env is None:
+            env = jinja2.Environment(**options)
+            _template_envs.set(env_key, env)
+        template = template_from_string(env, markup, repr(env_key))
+        _template_cache.set(key, template)
+    return template
+
+
+class CompiledTemplate(object):
+    """
+    Content compiled as a Jinja2 template by `compile_template`.
+
+    It can be passed as the content to be rendered instead of the markup,
+    so that only the template variables need to be given on each render.
+    """
+
+    def __init__(self, markup, env_options=None):
+        """Initialize."""
+
+        self.source = markup
+        self.env_options = env_options
+        # Like uncompiled content, the frontmatter is not part of the template.
+        self.frontmatter, markup = _frontmatter.get_frontmatter(markup)
+        self.template = _get_template(markup, env_options)
+
+    def __repr__(self):
+        """Represent the template by its source, so it can be part of a cache key."""
+
+        return 'CompiledTemplate({!r}, {!r})'.format(self.source, self.env_options)
+
+    def render(self, variables=None):
+        """Render the template with the given template variables."""
+
+        return self.template.render(plugin=variables)
+
+
+def _get_frontmatter(content):
+    """Get the frontmatter and the remaining content of either markup or a compiled template."""
+
+    if isinstance(content, CompiledTemplate):
+        return OrderedDict(content.frontmatter), content
+    return _frontmatter.get_frontmatter(content)
+
+
 def _markup_template(markup, variables, options):
     """Template for markup."""
 
+    if isinstance(markup, CompiledTemplate):
+        return markup.render(variables)
     if variables:
-        if options is None:
-            options = {}
-        env = jinja2.Environment(**options)
-        return env.from_string(markup).render(plugin=variables)
+        return _get_template(markup, options).render(plugin=variables)
     return markup
 
 
@@ -534,17 +790,33 @@ def version():
     return ver.version()
 
 
+def compile_template(markup, env_options=None):
+    """
+    Compile content as a Jinja2 template.
+
+    The returned object can be passed as the content of popups, phantoms, sheets, and `md2html`.
+    """
+
+    return CompiledTemplate(markup, env_options)
+
+
 def md2html(
-    view, markup, template_vars=None, template_env_options=None, **kwargs
+    view, markup, template_vars=None, template_env_options=None, frontmatter=None, **kwargs
 ):
-    """Convert Markdown to HTML."""
+    """
+    Convert Markdown to HTML.
+
+    Options can be given as a `frontmatter` dictionary instead of (or on top of) frontmatter in the markup.
+    """
 
     if _get_setting('mdpopups.use_sublime_highlighter', True):
         sublime_hl = (True, _get_sublime_highlighter(view))
     else:
         sublime_hl = (False, None)
 
-    fm, markup = frontmatter.get_frontmatter(markup)
+    fm, markup = _get_frontmatter(markup)
+    if frontmatter:
+        fm.update(frontmatter)
 
     parser = fm.get('markdown_parser', 'markdown')
     if parser == 'markdown':
@@ -612,13 +884,19 @@ def md2html(
                             )
                         extensions.append(ext)
 
-        return _MdWrapper(
-            extensions=extensions,
-            extension_configs=configs,
-            sublime_hl=sublime_hl,
-            allow_code_wrap=fm.get('allow_code_wrap', False),
-            language_map=fm.get('language_map', {})
-        ).convert(_markup_template(markup, template_vars, template_env_options))
+        allow_code_wrap = fm.get('allow_code_wrap', False)
+        language_map = fm.get('language_map', {})
+        return _pooled_convert(
+            _parser_key(parser, extensions, configs, sublime_hl, allow_code_wrap, language_map),
+            lambda: _MdWrapper(
+                extensions=extensions,
+                extension_configs=configs,
+                sublime_hl=sublime_hl,
+                allow_code_wrap=allow_code_wrap,
+                language_map=language_map
+            ),
+            _markup_template(markup, template_vars, template_env_options)
+        )
     elif parser == 'marko':
         extensions = ["mdx.marko_highlight"]
         md_exts = fm.get('markdown_extensions')
@@ -632,12 +910,18 @@ def md2html(
                 elif isinstance(ext, str):
                     if not ext.startswith('mdpopups.'):
                         extensions.append(ext)
-        return _MarkoWrapper(
-            extensions=extensions,
-            sublime_hl=sublime_hl[1],
-            allow_code_wrap=fm.get('allow_code_wrap', False),
-            language_map=fm.get('language_map', {})
-        ).convert(_markup_template(markup, template_vars, template_env_options))
+        allow_code_wrap = fm.get('allow_code_wrap', False)
+        language_map = fm.get('language_map', {})
+        return _pooled_convert(
+            _parser_key(parser, extensions, sublime_hl[1], allow_code_wrap, language_map),
+            lambda: _MarkoWrapper(
+                extensions=extensions,
+                sublime_hl=sublime_hl[1],
+                allow_code_wrap=allow_code_wrap,
+                language_map=language_map
+            ),
+            _markup_template(markup, template_vars, template_env_options)
+        )
 
     # No parser found
     _log(f'Unknown parser: {parser}')
@@ -651,7 +935,7 @@ def color_box(
     """Color box."""
 
     return colorbox.color_box(
-        [Color(c) for c in colors], Color(border), border2, height, width,
+        [Color(c) for c in colors], Color(border), Color(border2) if border2 is not None else None, height, width,
         border_size, check_size, max_colors, alpha, border_map
     )
 
@@ -663,7 +947,33 @@ def color_box_raw(
     """Color box raw."""
 
     return colorbox.color_box_raw(
-        [Color(c) for c in colors], Color(border), border2, height, width,
+        [Color(c) for c in colors], Color(border), Color(border2) if border2 is not None else None, height, width,
+        border_size, check_size, max_colors, alpha, border_map
+    )
+
+
+def color_box_batch(
+    color_sets, border="#000000ff", border2=None, height=32, width=32,
+    border_size=1, check_size=4, max_colors=5, alpha=False, border_map=0xF
+):
+    """Color box batch."""
+
+    return colorbox.color_box_batch(
+        [[Color(c) for c in colors] for colors in color_sets], Color(border),
+        Color(border2) if border2 is not None else None, height, width,
+        border_size, check_size, max_colors, alpha, border_map
+    )
+
+
+def color_box_raw_batch(
+    color_sets, border="#000000ff", border2=None, height=32, width=32,
+    border_size=1, check_size=4, max_colors=5, alpha=False, border_map=0xF
+):
+    """Color box raw batch."""
+
+    return colorbox.color_box_raw_batch(
+        [[Color(c) for c in colors] for colors in color_sets], Color(border),
+        Color(border2) if border2 is not None else None, height, width,
         border_size, check_size, max_colors, alpha, border_map
     )
 
@@ -767,12 +1077,45 @@ def scope2style(view, scope, selected=False, explicit_background=False):
     return style
 
 
+def prefetch_scopes(view, scopes):
+    """Resolve and memoize the styles of the given scopes for the view's color scheme."""
+
+    obj = _get_scheme(view.settings().get('color_scheme'))[0]
+    if obj is not None:
+        obj.prefetch_scopes(view, scopes)
+
+
 def clear_cache():
     """Clear cache."""
 
     _clear_cache()
 
 
+def purge_disk_cache():
+    """Delete the caches on disk."""
+
+    _purge_disk_cache()
+
+
+def cache_stats():
+    """Get cache statistics."""
+
+    return {
+        'schemes': _scheme_cache.stats(),
+        'highlighters': _highlighter_cache.stats(),
+        'html': _html_cache.stats(),
+        'frontmatter': _frontmatter.frontmatter_cache.stats(),
+        'templates': _template_cache.stats(),
+        'template_bytecode': get_template_bytecode_cache().stats(),
+        'fragments': fragment_cache.stats(),
+        'highlight_views': scratch_views.stats(),
+        'css_disk': get_css_disk_cache().stats(),
+        'color_boxes': colorbox.box_cache.stats(),
+        'tints': imagetint.tint_cache.stats(),
+        'images': _get_image_cache().stats()
+    }
+
+
 def hide_popup(view):
     """Hide the popup."""
 
@@ -781,7 +1124,7 @@ def hide_popup(view):
 
 def update_popup(
     view, content, md=True, css=None, wrapper_class=None,
-    template_vars=None, template_env_options=None, **kwargs
+    template_vars=None, template_env_options=None, cache=False, frontmatter=None, **kwargs
 ):
     """Update the popup."""
 
@@ -793,7 +1136,8 @@ def update_popup(
     try:
         html = _create_html(
             view, content, md, css, css_type=POPUP, wrapper_class=wrapper_class,
-            template_vars=template_vars, template_env_options=template_env_options
+            template_vars=template_vars, template_env_options=template_env_options, cache=cache,
+            frontmatter=frontmatter
         )
     except Exception:
         _log(traceback.format_exc())
@@ -806,7 +1150,7 @@ def show_popup(
     view, content, md=True, css=None,
     flags=0, location=-1, max_width=320, max_height=240,
     on_navigate=None, on_hide=None, wrapper_class=None,
-    template_vars=None, template_env_options=None, **kwargs
+    template_vars=None, template_env_options=None, cache=False, frontmatter=None, **kwargs
 ):
     """Parse the color scheme if needed and show the styled pop-up."""
 
@@ -821,7 +1165,8 @@ def show_popup(
     try:
         html = _create_html(
             view, content, md, css, css_type=POPUP, wrapper_class=wrapper_class,
-            template_vars=template_vars, template_env_options=template_env_options
+            template_vars=template_vars, template_env_options=template_env_options, cache=cache,
+            frontmatter=frontmatter
         )
     except Exception:
         _log(traceback.format_exc())
@@ -842,7 +1187,7 @@ def is_popup_visible(view):
 def add_phantom(
     view, key, region, content, layout, md=True,
     css=None, on_navigate=None, wrapper_class=None,
-    template_vars=None, template_env_options=None, **kwargs
+    template_vars=None, template_env_options=None, cache=False, frontmatter=None, **kwargs
 ):
     """Add a phantom and return phantom id."""
 
@@ -854,7 +1199,8 @@ def add_phantom(
     try:
         html = _create_html(
             view, content, md, css, css_type=PHANTOM, wrapper_class=wrapper_class,
-            template_vars=template_vars, template_env_options=template_env_options
+            template_vars=template_vars, template_env_options=template_env_options, cache=cache,
+            frontmatter=frontmatter
         )
     except Exception:
         _log(traceback.format_exc())
@@ -889,7 +1235,7 @@ def query_phantoms(view, pids):
 
 def new_html_sheet(
     window, name, contents, md=True, css=None, flags=0, group=-1,
-    wrapper_class=None, template_vars=None, template_env_options=None, **kwargs
+    wrapper_class=None, template_vars=None, template_env_options=None, frontmatter=None, **kwargs
 ):
     """Create new HTML sheet."""
 
@@ -897,7 +1243,7 @@ def new_html_sheet(
     try:
         html = _create_html(
             view, contents, md, css, css_type=SHEET, wrapper_class=wrapper_class,
-            template_vars=template_vars, template_env_options=template_env_options
+            template_vars=template_vars, template_env_options=template_env_options, frontmatter=frontmatter
         )
     except Exception:
         _log(traceback.format_exc())
@@ -908,7 +1254,7 @@ def new_html_sheet(
 
 def update_html_sheet(
     sheet, contents, md=True, css=None, wrapper_class=None,
-    template_vars=None, template_env_options=None, **kwargs
+    template_vars=None, template_env_options=None, frontmatter=None, **kwargs
 ):
     """Update an HTML sheet."""
 
@@ -923,7 +1269,7 @@ def update_html_sheet(
     try:
         html = _create_html(
             view, contents, md, css, css_type=SHEET, wrapper_class=wrapper_class,
-            template_vars=template_vars, template_env_options=template_env_options
+            template_vars=template_vars, template_env_options=template_env_options, frontmatter=frontmatter
         )
     except Exception:
         _log(traceback.format_exc())
@@ -932,13 +1278,192 @@ def update_html_sheet(
     sublime_api.html_sheet_set_contents(sheet.id(), html)
 
 
+##############################
+# Asynchronous rendering
+##############################
+_render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mdpopups-render')
+_render_requests = {}
+_render_lock = threading.Lock()
+
+
+class RenderRequest(object):
+    """
+    A handle to an asynchronous render.
+
+    The request can be cancelled up until the content is presented.
+    A newer request for the same popup or sheet will automatically cancel (supersede) an older one.
+    """
+
+    def __init__(self, target=None, present=None, update=False):
+        """Initialize."""
+
+        self.target = target
+        self.present = present
+        self.update = update
+        self.cancelled = False
+        self.done = False
+
+    def cancel(self):
+        """Cancel the request."""
+
+        self.cancelled = True
+
+    def is_cancelled(self):
+        """Check if the request has been cancelled."""
+
+        return self.cancelled
+
+    def is_done(self):
+        """Check if the content has been presented."""
+
+        return self.done
+
+
+def _render_async(
+    target, view, content, md, css, css_type, wrapper_class, template_vars, template_env_options,
+    cache, present, on_ready, frontmatter=None, update=False
+):
+    """
+    Render the HTML on the render thread and present it on the UI thread.
+
+    All of `_create_html` runs on the render thread, except for filling and reading back the output panels
+    of the Sublime highlighter, which is handed to the UI thread (see `run_on_ui_thread`).
+    If a `target` is given, any pending request for the same target is superseded. If an `update` supersedes
+    a pending request that would show the target, it takes over showing it, but with the newer content.
+    """
+
+    request = RenderRequest(target, present, update)
+    if target is not None:
+        with _render_lock:
+            previous = _render_requests.get(target)
+            if previous is not None:
+                if update and not previous.update and not previous.cancelled:
+                    request.present = previous.present
+                    request.update = False
+                previous.cancel()
+            _render_requests[target] = request
+    present = request.present
+
+    def finish(html):
+        """Present the HTML on the UI thread."""
+
+        if target is not None:
+            with _render_lock:
+                if _render_requests.get(target) is request:
+                    del _render_requests[target]
+        if request.cancelled:
+            return
+        result = present(html)
+        request.done = True
+        if on_ready is not None:
+            on_ready(result)
+
+    def render():
+        """Render the HTML."""
+
+        if request.cancelled:
+            return
+        try:
+            html = _create_html(
+                view, content, md, css, css_type=css_type, wrapper_class=wrapper_class,
+                template_vars=template_vars, template_env_options=template_env_options, cache=cache,
+                frontmatter=frontmatter
+            )
+        except Exception:
+            _log(traceback.format_exc())
+            html = IDK
+        sublime.set_timeout(lambda: finish(html))
+
+    _render_executor.submit(render)
+    return request
+
+
+def update_popup_async(
+    view, content, md=True, css=None, wrapper_class=None,
+    template_vars=None, template_env_options=None, cache=False, on_ready=None, frontmatter=None, **kwargs
+):
+    """Update the popup with content rendered off of the UI thread."""
+
+    disabled = _get_setting('mdpopups.disable', False)
+    if disabled:
+        _debug('Popups disabled', WARNING)
+        return None
+
+    return _render_async(
+        ('popup', view.id()), view, content, md, css, POPUP, wrapper_class, template_vars, template_env_options,
+        cache, view.update_popup, on_ready, frontmatter, update=True
+    )
+
+
+def show_popup_async(
+    view, content, md=True, css=None,
+    flags=0, location=-1, max_width=320, max_height=240,
+    on_navigate=None, on_hide=None, wrapper_class=None,
+    template_vars=None, template_env_options=None, cache=False, on_ready=None, frontmatter=None, **kwargs
+):
+    """Render the popup content off of the UI thread and show it once ready."""
+
+    disabled = _get_setting('mdpopups.disable', False)
+    if disabled:
+        _debug('Popups disabled', WARNING)
+        return None
+
+    if not _can_show(view, location):
+        return None
+
+    def present(html):
+        """Show the popup if it still can be shown."""
+
+        if _can_show(view, location):
+            view.show_popup(
+                html, flags=flags, location=location, max_width=max_width,
+                max_height=max_height, on_navigate=on_navigate, on_hide=on_hide
+            )
+
+    return _render_async(
+        ('popup', view.id()), view, content, md, css, POPUP, wrapper_class, template_vars, template_env_options,
+        cache, present, on_ready, frontmatter
+    )
+
+
+def add_phantom_async(
+    view, key, region, content, layout, md=True,
+    css=None, on_navigate=None, wrapper_class=None,
+    template_vars=None, template_env_options=None, cache=False, on_ready=None, frontmatter=None, **kwargs
+):
+    """Render the phantom content off of the UI thread and add the phantom once ready."""
+
+    disabled = _get_setting('mdpopups.disable', False)
+    if disabled:
+        _debug('Phantoms disabled', WARNING)
+        return None
+
+    return _render_async(
+        None, view, content, md, css, PHANTOM, wrapper_class, template_vars, template_env_options,
+        cache, lambda html: view.add_phantom(key, region, html, layout, on_navigate), on_ready, frontmatter
+    )
+
+
+def new_html_sheet_async(
+    window, name, contents, md=True, css=None, flags=0, group=-1,
+    wrapper_class=None, template_vars=None, template_env_options=None, on_ready=None, frontmatter=None, **kwargs
+):
+    """Render the content off of the UI thread and create the HTML sheet once ready."""
+
+    view = window.create_output_panel('mdpopups-dummy', unlisted=True)
+    return _render_async(
+        None, view, contents, md, css, SHEET, wrapper_class, template_vars, template_env_options,
+        False, lambda html: window.new_html_sheet(name, html, flags, group), on_ready, frontmatter
+    )
+
+
 class Phantom(sublime.Phantom):
     """A phantom object."""
 
     def __init__(
         self, region, content, layout, md=True,
         css=None, on_navigate=None, wrapper_class=None,
-        template_vars=None, template_env_options=None, **kwargs
+        template_vars=None, template_env_options=None, frontmatter=None, **kwargs
     ):
         """Initialize."""
 
@@ -948,6 +1473,35 @@ class Phantom(sublime.Phantom):
         self.wrapper_class = wrapper_class
         self.template_vars = template_vars
         self.template_env_options = template_env_options
+        self.frontmatter = frontmatter
+        self._content_key = None
+
+    def content_key(self):
+        """
+        Get a hash of everything that affects the rendered content.
+
+        It is computed once, so the content should not be changed after the phantom is first added.
+        """
+
+        if self._content_key is None:
+            key = repr(
+                (
+                    self.content, bool(self.md), self.css, self.wrapper_class, self.template_vars,
+                    self.template_env_options, self.frontmatter
+                )
+            )
+            self._content_key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return self._content_key
+
+    def key(self):
+        """Get a key that identifies equal phantoms, or `None` if one can't be created."""
+
+        key = (self.region.a, self.region.b, self.layout, self.on_navigate, self.content_key())
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+        return key
 
     def __eq__(self, rhs):
         """Check if phantoms are equal."""
@@ -958,7 +1512,7 @@ class Phantom(sublime.Phantom):
             self.layout == rhs.layout and self.on_navigate == rhs.on_navigate and
             self.md == rhs.md and self.css == rhs.css and
             self.wrapper_class == rhs.wrapper_class and self.template_vars == rhs.template_vars and
-            self.template_env_options == rhs.template_env_options
+            self.template_env_options == rhs.template_env_options and self.frontmatter == rhs.frontmatter
         )
 
 
@@ -983,7 +1537,14 @@ class PhantomSet(sublime.PhantomSet):
         for i in range(len(regions)):
             self.phantoms[i].region = regions[i]
 
+        # Index the current phantoms by key, so each new phantom is matched without comparing it against all of them.
+        current = {}
+        for p in self.phantoms:
+            current.setdefault(p.key(), []).append(p)
+        current.pop(None, None)
+
         count = 0
+        kept = set()
         for p in new_phantoms:
             if not isinstance(p, Phantom):
                 # Convert sublime.Phantom to mdpopups.Phantom
@@ -993,11 +1554,12 @@ class PhantomSet(sublime.PhantomSet):
                     template_vars=None, template_env_options=None
                 )
                 new_phantoms[count] = p
-            try:
+            existing = current.get(p.key())
+            if existing:
                 # Phantom already exists, copy the id from the current one
-                idx = self.phantoms.index(p)
-                p.id = self.phantoms[idx].id
-            except ValueError:
+                p.id = existing.pop(0).id
+                kept.add(p.id)
+            else:
                 p.id = add_phantom(
                     self.view,
                     self.key,
@@ -1009,13 +1571,14 @@ class PhantomSet(sublime.PhantomSet):
                     p.on_navigate,
                     p.wrapper_class,
                     p.template_vars,
-                    p.template_env_options
+                    p.template_env_options,
+                    frontmatter=p.frontmatter
                 )
             count += 1
 
         for p in self.phantoms:
             # if the region is -1, then it's already been deleted, no need to call erase
-            if p not in new_phantoms and p.region != sublime.Region(-1):
+            if p.id not in kept and p.region != sublime.Region(-1):
                 erase_phantom_by_id(self.view, p.id)
 
         self.phantoms = new_phantoms
@@ -1024,52 +1587,7 @@ class PhantomSet(sublime.PhantomSet):
 def format_frontmatter(values):
     """Format values as frontmatter."""
 
-    return frontmatter.dump_frontmatter(values)
-
-
-RE_TAG_HTML = re.compile(
-    r'''(?xus)
-    (?:
-        (?P<avoid>
-            <\s*(?P<script_name>script|style)[^>]*>.*?</\s*(?P=script_name)\s*> |
-            (?:(\r?\n?\s*)<!--[\s\S]*?-->(\s*)(?=\r?\n)|<!--[\s\S]*?-->)
-        )|
-        (?P<open><\s*(?P<tag>img))
-        (?P<attr>(?:\s+[\w\-:]+(?:\s*=\s*(?:"[^"]*"|'[^']*'))?)*)
-        (?P<close>\s*(?:\/?)>)
-    )
-    '''
-)
-
-RE_TAG_LINK_ATTR = re.compile(
-    r'''(?xus)
-    (?P<attr>
-        (?:
-            (?P<name>\s+src\s*=\s*)
-            (?P<path>"[^"]*"|'[^']*')
-        )
-    )
-    '''
-)
-
-
-def _image_parser(text):
-    """Retrieve image source whose attribute `src` URL has scheme 'http' or 'https'."""
-
-    images = {}
-    for m in RE_TAG_HTML.finditer(text):
-        if m.group('avoid'):
-            continue
-        start = m.start('attr')
-        m2 = RE_TAG_LINK_ATTR.search(m.group('attr'))
-        if m2:
-            src = m2.group('path')[1:-1]
-            src = _unescape_html(src)
-            if urllib.parse.urlparse(src).scheme in ("http", "https"):
-                s = start + m2.start('path') + 1
-                e = start + m2.end('path') - 1
-                images.setdefault(src, []).append((s, e))
-    return images
+    return _frontmatter.dump_frontmatter(values)
 
 
 class _ImageResolver:
@@ -1080,14 +1598,107 @@ class _ImageResolver:
     In an asynchronous world, we would of course use `asyncio.gather`.
     """
 
-    def __init__(self, minihtml, resolver, done_callback, images_to_resolve):
+    def __init__(self, minihtml, resolver, done_callback, index, progress_callback=None):
         """The constructor."""
         self.minihtml = minihtml
+        self.index = index
         self.done_callback = done_callback
-        self.images_to_resolve = images_to_resolve
+        self.progress_callback = progress_callback
+        self.progress_scheduled = False
+        self.images_to_resolve = index.images()
         self.resolved = {}
+        self.cancelled = False
+        self.finished = False
+        self.lock = threading.Lock()
+        # Resolvers may return a handle with a `cancel` method, such as `pooled_resolver`.
+        self.handles = []
+        # The built-in resolvers store downloads in the image cache themselves (along with their validators).
+        self.cache = _get_image_cache()
+        self.store = resolver not in _CACHING_RESOLVERS
+
+        # Split the HTML into parts, so the `src` of each image can be replaced on its own as it is resolved.
+        self.parts = []
+        self.slots = {}
+        last = 0
+        for start, end, url in index.spans():
+            self.parts.append(minihtml[last:start])
+            self.slots.setdefault(url, []).append(len(self.parts))
+            self.parts.append(minihtml[start:end])
+            last = end
+        self.parts.append(minihtml[last:])
+
+        # Recent failures are remembered in memory, so they are skipped right away.
+        pending = []
         for url in self.images_to_resolve.keys():
-            resolver(url, functools.partial(self.on_image_resolved, url))
+            exception = self.cache.failure(url)
+            if exception is not None:
+                self.resolved[url] = (exception, None)
+            else:
+                pending.append(url)
+
+        if not pending:
+            self.finalize()
+            return
+
+        # Looking up images on disk is left to the worker thread, so the caller is never blocked by it.
+        sublime.set_timeout_async(lambda: self.lookup(pending, resolver))
+
+    def lookup(self, pending, resolver):
+        """Use the images cached on disk, and resolve the rest."""
+        missing = []
+        for url in pending:
+            if self.cancelled:
+                return
+            entry = self.cache.get(url)
+            if entry is not None and self.cache.is_fresh(entry):
+                with self.lock:
+                    self.resolved[url] = (entry['data'], entry['mime'])
+                    self.splice(url)
+            else:
+                missing.append(url)
+
+        if not missing:
+            self.finalize()
+            return
+
+        if self.progress_callback is not None:
+            with self.lock:
+                progress = not self.progress_scheduled
+                self.progress_scheduled = True
+            if progress:
+                sublime.set_timeout(self.on_progress)
+
+        for url in missing:
+            handle = resolver(url, functools.partial(self.on_image_resolved, url))
+            if handle is not None:
+                with self.lock:
+                    self.handles.append(handle)
+                    cancelled = self.cancelled
+                if cancelled:
+                    handle.cancel()
+
+    def cancel(self):
+        """
+        Cancel resolving the images, for instance when the popup or sheet they were for is closed.
+
+        Pending downloads of cancellable resolvers are dropped, and the `done_callback` is not called.
+        """
+        with self.lock:
+            self.cancelled = True
+            handles = list(self.handles)
+        for handle in handles:
+            handle.cancel()
+
+    def splice(self, url):
+        """Replace the `src` of all images with the URL with the resolved image data."""
+        data, mime = self.resolved[url]
+        if isinstance(data, Exception):
+            # keep the minihtml unchanged
+            return
+        # replace the URL with the base64 data
+        src = "data:" + mime + ";base64," + data
+        for index in self.slots[url]:
+            self.parts[index] = src
 
     def on_image_resolved(self, url, data, mime, exception):
         """
@@ -1100,11 +1711,34 @@ class _ImageResolver:
         """
         if exception:
             value = (exception, None)
+            self.cache.fail(url, exception)
         else:
             value = (base64.b64encode(data).decode("ascii"), mime)
-        self.resolved[url] = value
-        if len(self.resolved) == len(self.images_to_resolve):
+            if self.store:
+                self.cache.set(url, value[0], mime)
+        # Resolvers may call back from multiple threads at once.
+        with self.lock:
+            if self.cancelled or url in self.resolved:
+                return
+            self.resolved[url] = value
+            self.splice(url)
+            self.finished = len(self.resolved) == len(self.images_to_resolve)
+            progress = not self.finished and self.progress_callback is not None and not self.progress_scheduled
+            if progress:
+                self.progress_scheduled = True
+        if self.finished:
             self.finalize()
+        elif progress:
+            sublime.set_timeout(self.on_progress)
+
+    def on_progress(self):
+        """Invoke the `progress_callback` with the images resolved so far (coalescing images resolved meanwhile)."""
+        with self.lock:
+            self.progress_scheduled = False
+            if self.cancelled or self.finished:
+                return
+            html = "".join(self.parts)
+        self.progress_callback(html)
 
     def finalize(self):
         """
@@ -1114,58 +1748,9 @@ class _ImageResolver:
 
         It invokes the `done_callback` from the `resolve_urls` function in the main thread of Sublime Text.
         """
-
-        def flattened():
-            for url, positions in self.images_to_resolve.items():
-                for position in positions:
-                    yield url, position[0], position[1]
-
-        todo = sorted(flattened(), key=lambda t: (t[1], t[2]))
-        chunks = [self.minihtml[:todo[0][1]]]
-        for index in range(0, len(todo)):
-            next_index = index + 1
-            if next_index >= len(todo):
-                next_start = len(self.minihtml)
-            else:
-                next_start = todo[next_index][1]
-            data, mime = self.resolved[todo[index][0]]
-            current_end = todo[index][2]
-            if isinstance(data, Exception):
-                # keep the minihtml unchanged
-                current_start = todo[index][1]
-                chunks.append(self.minihtml[current_start:current_end])
-            else:
-                # replace the URL with the base64 data
-                chunks.append("data:")
-                chunks.append(mime)
-                chunks.append(";base64,")
-                chunks.append(data)
-            chunks.append(self.minihtml[current_end:next_start])
-        finalhtml = "".join(chunks)
-        sublime.set_timeout(lambda: self.done_callback(finalhtml))
-
-
-@functools.lru_cache(maxsize=8)
-def _retrieve(url):
-    """
-    Actually download the image pointed to by the passed URL.
-
-    The most recently used images (8 at most) are kept in a cache.
-    """
-    import urllib.request
-    with urllib.request.urlopen(url) as response:
-        # We provide some basic protection against absurdly large images.
-        # 32MB is chosen as an arbitrary upper limit. This can be raised if desired.
-        length = response.headers.get("content-length")
-        if length is None:
-            raise ValueError("missing content-length header")
-        length = int(length)
-        if length == 0:
-            raise ValueError("empty payload")
-        elif length >= 32 * 1024 * 1024:
-            raise ValueError("refusing to read payloads larger than or equal to 32MB")
-        mime = response.headers.get("content-type", "image/png").lower()
-        return response.readall(), mime
+        self.finished = True
+        finalhtml = "".join(self.parts)
+        sublime.set_timeout(lambda: self.cancelled or self.done_callback(finalhtml))
 
 
 def blocking_resolver(url, done):
@@ -1174,7 +1759,7 @@ def blocking_resolver(url, done):
     payload = None
     mime = None
     try:
-        payload, mime = _retrieve(url)
+        payload, mime = _get_image_fetcher().retrieve(url)
     except Exception as ex:
         exception = ex
     if exception:
@@ -1195,7 +1780,59 @@ def worker_thread_resolver(url, done):
     sublime.set_timeout_async(lambda: blocking_resolver(url, done))
 
 
-def resolve_images(minihtml, resolver, on_done):
+_image_fetcher = None
+_image_cache = None
+_image_fetcher_lock = threading.Lock()
+
+
+def _get_image_cache():
+    """Get the shared cache of remote images, creating it on first use."""
+
+    global _image_cache
+
+    with _image_fetcher_lock:
+        if _image_cache is None:
+            limit = _get_setting('mdpopups.image_cache_limit', imagefetch.IMAGE_CACHE_BUDGET // (1024 * 1024))
+            if not isinstance(limit, (int, float)) or limit < 0:
+                limit = imagefetch.IMAGE_CACHE_BUDGET // (1024 * 1024)
+            _image_cache = imagefetch.ImageCache(
+                os.path.join(sublime.cache_path(), 'mdpopups', 'images'), int(limit * 1024 * 1024)
+            )
+        return _image_cache
+
+
+def _get_image_fetcher():
+    """Get the shared image fetcher, creating it on first use."""
+
+    global _image_fetcher
+
+    cache = _get_image_cache()
+    with _image_fetcher_lock:
+        if _image_fetcher is None:
+            limit = _get_setting('mdpopups.image_fetch_limit', imagefetch.FETCH_LIMIT)
+            if not isinstance(limit, int) or limit < 1:
+                limit = imagefetch.FETCH_LIMIT
+            timeout = _get_setting('mdpopups.image_fetch_timeout', imagefetch.FETCH_TIMEOUT)
+            if not isinstance(timeout, (int, float)) or timeout <= 0:
+                timeout = imagefetch.FETCH_TIMEOUT
+            _image_fetcher = imagefetch.ImageFetcher(limit, timeout, cache)
+        return _image_fetcher
+
+
+def pooled_resolver(url, done):
+    """
+    A URL resolver that downloads images in parallel on a bounded pool of threads.
+
+    Connections are kept alive and reused per host. Returns a handle that can be cancelled.
+    """
+    return _get_image_fetcher().fetch(url, done)
+
+
+# Resolvers that store what they download in the image cache.
+_CACHING_RESOLVERS = (blocking_resolver, ui_thread_resolver, worker_thread_resolver, pooled_resolver)
+
+
+def resolve_images(minihtml, resolver, on_done, on_progress=None, index=None):
     """
     Download images from the internet.
 
@@ -1217,11 +1854,22 @@ def resolve_images(minihtml, resolver, on_done):
     This function is non-blocking.
     It will invoke the passed-in `done_callback` on the UI thread.
     It returns an opaque object that should be kept alive for as long as the passed-in `done_callback` is not yet
-    invoked.
+    invoked. Calling `cancel` on the object stops any pending downloads and the `done_callback` will not be invoked.
+
+    Images are cached on disk, and images that recently failed to download are not retried for a while, so the
+    resolver is only called for images that are not cached or are stale. The disk cache is read on the worker
+    thread of Sublime Text, which is also where the resolver is called from.
+
+    The optional fourth argument is a callable that takes the same argument as `on_done`. If given, it is invoked on
+    the UI thread with the minihtml containing the images resolved so far, first with any cached images, and then as
+    more images are resolved. It is not invoked for the final minihtml, which is passed to `on_done`.
+
+    The returned object has an `index` attribute with the positions of the images in the minihtml. When the minihtml
+    is changed and resolved again, such as when a sheet is updated with `update_html_sheet`, the previous `index` can
+    be passed via the optional `index` argument, so that only the part of the minihtml that changed is scanned again.
     """
-    images = _image_parser(minihtml)
-    if images:
-        return _ImageResolver(minihtml, resolver, on_done, images)
+    if index is None:
+        index = ImageIndex(minihtml)
     else:
-        sublime.set_timeout(lambda: on_done(minihtml))
-        return None
+        index.update(minihtml)
+    return _ImageResolver(minihtml, resolver, on_done, index, on_progress)
@@ -0,0 +1,259 @@
+"""
+Cache utilities.
+
+Licensed under MIT
+Copyright (c) 2015 - 2020 Isaac Muse <isaacmuse@gmail.com>
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+FRAGMENT_CACHE_LIMIT = 100
+
+
+class LRUCache(object):
+    """
+    A thread safe, least recently used cache.
+
+    Hits move the entry to the end of the cache and the
+    least recently used entries are evicted once `limit` is exceeded.
+    If `sizeof` is given, it is used to estimate the memory used by each value
+    when it is added. If `ttl` is given, entries older than `ttl` seconds are
+    treated as missing (and removed) when they are next looked up.
+    """
+
+    def __init__(self, limit=10, sizeof=None, ttl=None):
+        """Initialize."""
+
+        self.limit = limit
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.RLock()
+        # Entries are stored as `(value, time added, size)`.
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        """Number of entries in the cache."""
+
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Check if key is in the cache (does not count as a hit or miss)."""
+
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Get an entry from the cache and mark it as recently used."""
+
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and self.ttl is not None and time.time() - entry[1] >= self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """Add an entry to the cache, evicting the least recently used entries if needed."""
+
+        with self._lock:
+            self._remove(key)
+            size = self.sizeof(value) if self.sizeof is not None else 0
+            self._entries[key] = (value, time.time(), size)
+            self.memory += size
+            self._prune()
+
+    def pop(self, key, default=None):
+        """Remove an entry from the cache."""
+
+        with self._lock:
+            entry = self._remove(key)
+            return default if entry is _MISSING else entry[0]
+
+    def resize(self, limit, ttl=_MISSING):
+        """Change the limit of the cache, and optionally the time to live of entries."""
+
+        with self._lock:
+            self.limit = limit
+            if ttl is not _MISSING:
+                self.ttl = ttl
+            self._prune()
+
+    def clear(self):
+        """Clear the cache."""
+
+        with self._lock:
+            self._entries.clear()
+            self.memory = 0
+
+    def stats(self):
+        """Return cache statistics."""
+
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'limit': self.limit
+            }
+            if self.ttl is not None:
+                stats['expirations'] = self.expirations
+                stats['ttl'] = self.ttl
+            if self.sizeof is not None:
+                stats['memory'] = self.memory
+            return stats
+
+    def _remove(self, key):
+        """Remove an entry and account for its memory."""
+
+        entry = self._entries.pop(key, _MISSING)
+        if entry is not _MISSING:
+            self.memory -= entry[2]
+        return entry
+
+    def _prune(self):
+        """Evict the least recently used entries."""
+
+        while len(self._entries) > max(self.limit, 0):
+            self.memory -= self._entries.popitem(last=False)[1][2]
+            self.evictions += 1
+
+
+class DiskCache(object):
+    """
+    A size bounded cache of byte strings stored on disk.
+
+    Each value is stored in a file named after the hash of its key. Files are written to a temporary file
+    and then moved into place, so multiple processes can safely share the same cache directory. Reading
+    an entry touches the file, and once the total size exceeds the `budget` (in bytes) the least recently
+    used files are removed. All I/O errors are treated as a cache miss as the cache is only an optimization.
+    """
+
+    def __init__(self, path, budget=5 * 1024 * 1024):
+        """Initialize."""
+
+        self.path = path
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _file(self, key):
+        """Get the file for the key."""
+
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key, default=None):
+        """Get an entry from the cache."""
+
+        filename = self._file(key)
+        try:
+            with open(filename, 'rb') as f:
+                value = f.read()
+            os.utime(filename)
+        except OSError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store an entry in the cache."""
+
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(value)
+                os.replace(tmp, self._file(key))
+            except OSError:
+                os.remove(tmp)
+                raise
+        except OSError:
+            return
+        self.prune()
+
+    def pop(self, key):
+        """Remove an entry from the cache."""
+
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def _entries(self):
+        """Get a list of `(mtime, size, path)` for each file in the cache."""
+
+        entries = []
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return entries
+        for name in names:
+            if name.startswith('.tmp-'):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def prune(self):
+        """Remove the least recently used files until the cache fits within the budget."""
+
+        entries = self._entries()
+        total = sum(e[1] for e in entries)
+        if total <= self.budget:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all files from the cache."""
+
+        for entry in self._entries():
+            try:
+                os.remove(entry[2])
+            except OSError:
+                pass
+
+    def stats(self):
+        """Return cache statistics."""
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': sum(e[1] for e in self._entries()),
+            'limit': self.budget
+        }
+
+
+# Highlighted code fragments shared by both the Sublime and Pygments highlighters.
+fragment_cache = LRUCache(FRAGMENT_CACHE_LIMIT)
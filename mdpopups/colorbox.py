@@ -7,8 +7,11 @@ Copyright (c) 2015 - 2020 Isaac Muse <isaacmuse@gmail.com>
 from mdpopups.png import Writer
 from .coloraide import Color
 from .coloraide import algebra as alg
+from .cache import LRUCache
+from array import array
 import base64
 import io
+import struct
 
 CHECK_LIGHT = Color("#FFFFFF")
 CHECK_DARK = Color("#CCCCCC")
@@ -25,10 +28,17 @@ LEFT = 8
 X = 0
 Y = 1
 
-__all__ = ('color_box',)
+__all__ = ('color_box', 'color_box_raw', 'color_box_batch', 'color_box_raw_batch')
 
 BIT_DEPTH = 16
 MAX_VALUE = 2 ** BIT_DEPTH - 1
+BOX_CACHE_LIMIT = 200
+
+# Generated images are small and short lived, so favor speed over size when compressing them.
+COMPRESSION_LEVEL = 1
+
+# Finished PNG bytes keyed by the colors and all options used to render them.
+box_cache = LRUCache(BOX_CACHE_LIMIT)
 
 
 def process_channel(c):
@@ -49,6 +59,20 @@ def to_list(rgb, alpha=False):
     return [r, g, b, a] if alpha else [r, g, b]
 
 
+def pack_pixel(channels):
+    """Pack a pixel's channels as big endian 16 bit values as expected by PNG."""
+
+    return struct.pack('>{}H'.format(len(channels)), *channels)
+
+
+def color_key(color):
+    """Get a hashable key for a color."""
+
+    if isinstance(color, Color):
+        return (color.space(), tuple(color[:]))
+    return color
+
+
 def checkered_color(color, background):
     """Mix color with the checkered color."""
 
@@ -73,181 +97,207 @@ def get_border_size(direction, border_map):
     return size
 
 
-def color_box_raw(
-    colors, border=None, border2=None, height=32, width=32,
-    border_size=1, check_size=4, max_colors=5, alpha=False, border_map=0xF,
-    gamut_space='srgb'
-):
+class ColorBoxRenderer(object):
     """
-    Generate palette preview.
+    Render color boxes that share the same options.
 
-    Create a color box with the specified RGBA color(s)
-    and RGB(A) border (alpha will be stripped out of border color).
-    Colors is a list of colors, but only up to 5
-    Border can be up to 2 colors (double border).
-
-    Height, width and border thickness can all be defined.
-
-    If using a transparent color, you can define the checkerboard pattern size that shows through.
-    If using multiple colors, you can control the max colors to display.  Colors currently are done
-    horizontally only.
-
-    Define size of swatch, border width,  and size of checkerboard squares.
+    Rows are built as packed byte arrays. The border rows and the left and right edges only depend on the options,
+    so they are built once per renderer. The colored area of a swatch only has two distinct rows, one for each
+    phase of the checkerboard, so those are built once per swatch and repeated.
     """
 
-    assert height - (border_size * 2) >= 0, "Border size too big!"
-    assert width - (border_size * 2) >= 0, "Border size too big!"
-    check_light = CHECK_LIGHT.convert(gamut_space)
-    check_dark = CHECK_DARK.convert(gamut_space)
-    transparent = TRANSPARENT.convert(gamut_space)
-
-    if border is None:
-        border = Color(gamut_space, [1, 1, 1])
+    def __init__(
+        self, border=None, border2=None, height=32, width=32,
+        border_size=1, check_size=4, max_colors=5, alpha=False, border_map=0xF,
+        gamut_space='srgb'
+    ):
+        """Initialize."""
+
+        assert height - (border_size * 2) >= 0, "Border size too big!"
+        assert width - (border_size * 2) >= 0, "Border size too big!"
+
+        self.height = height
+        self.width = width
+        self.check_size = check_size
+        self.max_colors = max_colors
+        self.alpha = alpha
+        self.check_light = CHECK_LIGHT.convert(gamut_space)
+        self.check_dark = CHECK_DARK.convert(gamut_space)
+        self.transparent = TRANSPARENT.convert(gamut_space)
+
+        if border is None:
+            border = Color(gamut_space, [1, 1, 1])
+
+        # Borders are always opaque, so give them a full alpha channel when the image has one.
+        opaque = [MAX_VALUE] if alpha else []
+        border = pack_pixel(to_list(border, False) + opaque)
+        if border2 is not None:
+            border2 = pack_pixel(to_list(border2, False) + opaque)
+
+        border1_size = border2_size = int(border_size / 2)
+        border1_size += border_size % 2
+        if border2 is None:
+            border1_size += border2_size
+            border2_size = 0
+
+        self.color_height = height - (border_size * get_border_size(Y, border_map))
+        self.color_width = width - (border_size * get_border_size(X, border_map))
+
+        self.left = b''
+        if border_map & LEFT:
+            self.left = border * border1_size
+            if border2:
+                self.left += border2 * border2_size
 
-    # Gather preview colors
-    preview_colors = []
-    count = max_colors if len(colors) >= max_colors else len(colors)
+        self.right = b''
+        if border_map & RIGHT:
+            if border2:
+                self.right += border2 * border2_size
+            self.right += border * border1_size
 
-    border = to_list(border, False)
-    if border2 is not None:
-        border2 = to_list(border2, False)
+        outer = [array('B', border * width)] * border1_size
+        inner = [array('B', self.left + (border2 or b'') * self.color_width + self.right)] * border2_size
+        self.top = outer + inner if border_map & TOP else []
+        self.bottom = inner + outer if border_map & BOTTOM else []
 
-    border1_size = border2_size = int(border_size / 2)
-    border1_size += border_size % 2
-    if border2 is None:
-        border1_size += border2_size
-        border2_size = 0
+    def get_preview_colors(self, colors):
+        """Get the packed light and dark checkerboard pixels for each color."""
 
-    if count:
+        preview_colors = []
+        count = self.max_colors if len(colors) >= self.max_colors else len(colors)
         for c in range(0, count):
-            if alpha:
-                preview_colors.append(
-                    (
-                        to_list(colors[c], True),
-                        to_list(colors[c], True)
-                    )
-                )
+            if self.alpha:
+                pixel = pack_pixel(to_list(colors[c], True))
+                preview_colors.append((pixel, pixel))
             else:
                 preview_colors.append(
                     (
-                        to_list(checkered_color(colors[c], check_light)),
-                        to_list(checkered_color(colors[c], check_dark))
+                        pack_pixel(to_list(checkered_color(colors[c], self.check_light))),
+                        pack_pixel(to_list(checkered_color(colors[c], self.check_dark)))
                     )
                 )
-    else:
-        if alpha:
-            preview_colors.append(
-                (to_list(transparent), to_list(transparent))
-            )
-        else:
-            preview_colors.append(
-                (to_list(check_light), to_list(check_dark))
-            )
-
-    color_height = height - (border_size * get_border_size(Y, border_map))
-    color_width = width - (border_size * get_border_size(X, border_map))
-
-    if count:
-        dividers = int(color_width / count)
-        if color_width % count:
-            dividers += 1
-    else:
-        dividers = 0
-
-    color_size_x = color_width
-
-    p = []
-
-    # Top Border
-    if border_map & TOP:
-        for _ in range(0, border1_size):
-            row = list(border * width)
-            p.append(row)
-        for _ in range(0, border2_size):
-            row = []
-            if border_map & LEFT and border_map & RIGHT:
-                row += list(border * border1_size)
-                row += list(border2 * border2_size)
-                row += list(border2 * color_width)
-                row += list(border2 * border2_size)
-                row += list(border * border1_size)
-            elif border_map & RIGHT:
-                row += list(border2 * color_width)
-                row += list(border2 * border2_size)
-                row += list(border * border1_size)
-            elif border_map & LEFT:
-                row += list(border * border1_size)
-                row += list(border2 * border2_size)
-                row += list(border2 * color_width)
+
+        if not preview_colors:
+            if self.alpha:
+                pixel = pack_pixel(to_list(self.transparent, True))
+                preview_colors.append((pixel, pixel))
             else:
-                row += list(border2 * color_width)
-            p.append(row)
+                preview_colors.append((pack_pixel(to_list(self.check_light)), pack_pixel(to_list(self.check_dark))))
+        return preview_colors, count
 
-    check_color_y = DARK
-    for y in range(0, color_height):
-        index = 0
-        if y % check_size == 0:
-            check_color_y = DARK if check_color_y == LIGHT else LIGHT
+    def color_row(self, preview_colors, dividers, check_color):
+        """Build a row of the colored area that starts with the given checkerboard phase."""
 
-        # Left border
-        row = []
-        if border_map & LEFT:
-            row += list(border * border1_size)
-            if border2:
-                row += list(border2 * border2_size)
-
-        check_color_x = check_color_y
-        for x in range(0, color_size_x):
+        index = 0
+        pixels = []
+        for x in range(0, self.color_width):
             if x != 0 and dividers != 0 and x % dividers == 0:
                 index += 1
-            if x % check_size == 0:
-                check_color_x = DARK if check_color_x == LIGHT else LIGHT
-            row += (preview_colors[index][1] if check_color_x == DARK else preview_colors[index][0])
+            if x % self.check_size == 0:
+                check_color = DARK if check_color == LIGHT else LIGHT
+            pixels.append(preview_colors[index][1] if check_color == DARK else preview_colors[index][0])
+        return array('B', self.left + b''.join(pixels) + self.right)
 
-        if border_map & RIGHT:
-            # Right border
-            if border2:
-                row += list(border2 * border2_size)
-            row += list(border * border1_size)
-
-        p.append(row)
-
-    if border_map & BOTTOM:
-        # Bottom border
-        for _ in range(0, border2_size):
-            row = []
-            if border_map & LEFT and border_map & RIGHT:
-                row += list(border * border1_size)
-                row += list(border2 * border2_size)
-                row += list(border2 * color_width)
-                row += list(border2 * border2_size)
-                row += list(border * border1_size)
-            elif border_map & LEFT:
-                row += list(border * border1_size)
-                row += list(border2 * border2_size)
-                row += list(border2 * color_width)
-            elif border_map & RIGHT:
-                row += list(border2 * color_width)
-                row += list(border2 * border2_size)
-                row += list(border * border1_size)
-            else:
-                row += list(border2 * color_width)
-            p.append(row)
-        for _ in range(0, border1_size):
-            row = list(border * width)
-            p.append(row)
+    def render(self, colors):
+        """Render a color box and return the PNG bytes."""
 
-    # Create bytes buffer for PNG
-    with io.BytesIO() as f:
+        preview_colors, count = self.get_preview_colors(colors)
 
-        # Write out PNG
-        img = Writer(width, height, alpha=alpha, bitdepth=BIT_DEPTH)
-        img.write(f, p)
+        if count:
+            dividers = int(self.color_width / count)
+            if self.color_width % count:
+                dividers += 1
+        else:
+            dividers = 0
+
+        rows = {
+            LIGHT: self.color_row(preview_colors, dividers, LIGHT),
+            DARK: self.color_row(preview_colors, dividers, DARK)
+        }
+
+        p = list(self.top)
+        check_color_y = DARK
+        for y in range(0, self.color_height):
+            if y % self.check_size == 0:
+                check_color_y = DARK if check_color_y == LIGHT else LIGHT
+            p.append(rows[check_color_y])
+        p.extend(self.bottom)
+
+        # Create bytes buffer for PNG
+        with io.BytesIO() as f:
+
+            # Write out PNG
+            img = Writer(self.width, self.height, alpha=self.alpha, bitdepth=BIT_DEPTH, compression=COMPRESSION_LEVEL)
+            img.write_buffer(f, b''.join(p))
+
+            # Read out PNG bytes
+            f.seek(0)
+
+            return f.read()
+
+
+def color_box_raw_batch(
+    color_sets, border=None, border2=None, height=32, width=32,
+    border_size=1, check_size=4, max_colors=5, alpha=False, border_map=0xF,
+    gamut_space='srgb'
+):
+    """
+    Generate many palette previews that share the same options.
+
+    `color_sets` is a list where each entry is a list of colors for one color box.
+    The PNG bytes of each color box are returned in the same order.
+    """
+
+    options = (
+        color_key(border), color_key(border2), height, width,
+        border_size, check_size, max_colors, alpha, border_map, gamut_space
+    )
+
+    renderer = None
+    results = []
+    for colors in color_sets:
+        key = (tuple(color_key(c) for c in colors[:max_colors]),) + options
+        data = box_cache.get(key)
+        if data is None:
+            if renderer is None:
+                renderer = ColorBoxRenderer(
+                    border, border2, height, width,
+                    border_size, check_size, max_colors, alpha, border_map,
+                    gamut_space
+                )
+            data = renderer.render(colors)
+            box_cache.set(key, data)
+        results.append(data)
+    return results
+
+
+def color_box_raw(
+    colors, border=None, border2=None, height=32, width=32,
+    border_size=1, check_size=4, max_colors=5, alpha=False, border_map=0xF,
+    gamut_space='srgb'
+):
+    """
+    Generate palette preview.
+
+    Create a color box with the specified RGBA color(s)
+    and RGB(A) border (alpha will be stripped out of border color).
+    Colors is a list of colors, but only up to 5
+    Border can be up to 2 colors (double border).
 
-        # Read out PNG bytes and base64 encode
-        f.seek(0)
+    Height, width and border thickness can all be defined.
 
-        return f.read()
+    If using a transparent color, you can define the checkerboard pattern size that shows through.
+    If using multiple colors, you can control the max colors to display.  Colors currently are done
+    horizontally only.
+
+    Define size of swatch, border width,  and size of checkerboard squares.
+    """
+
+    return color_box_raw_batch(
+        [colors], border, border2, height, width,
+        border_size, check_size, max_colors, alpha, border_map,
+        gamut_space
+    )[0]
 
 
 def color_box(*args, **kwargs):
@@ -256,3 +306,12 @@ def color_box(*args, **kwargs):
     return '<img src="data:image/png;base64,{}">'.format(
         base64.b64encode(color_box_raw(*args, **kwargs)).decode('ascii')
     )
+
+
+def color_box_batch(*args, **kwargs):
+    """Generate many palette previews and base64 encode them."""
+
+    return [
+        '<img src="data:image/png;base64,{}">'.format(base64.b64encode(data).decode('ascii'))
+        for data in color_box_raw_batch(*args, **kwargs)
+    ]
@@ -1,8 +1,32 @@
 """Frontmatter stripping."""
 from . import yaml
+from .cache import LRUCache
+import copy
 import re
 from collections import OrderedDict
 
+FRONTMATTER_CACHE_LIMIT = 50
+
+RE_FRONTMATTER = re.compile(r'^(-{3}\r?\n(?!\r?\n)(.*?)(?<=\n)(?:-{3}|\.{3})\r?\n)', re.DOTALL)
+RE_KEY = re.compile(
+    r'''^(?:'((?:[^']|'')*)'|"([^"\\]*)"|([^\s'"#\[\]{},&*!|>%@`?:\-][^#]*?|-[^\s#][^#]*?))[ ]*:(?:[ ]+(.*))?$'''
+)
+RE_SINGLE_QUOTED = re.compile(r"^'((?:[^']|'')*)'$")
+RE_DOUBLE_QUOTED = re.compile(r'^"([^"\\]*)"$')
+RE_PLAIN_SCALAR = re.compile(r'''^(?![\-?:][ ]|[\-?:]$)[^\s'"#\[\]{},&*!|>%@`](?:(?![ ]#|:[ ]).)*(?<!:)$''')
+PLAIN_TAGS = {
+    'tag:yaml.org,2002:null',
+    'tag:yaml.org,2002:bool',
+    'tag:yaml.org,2002:int',
+    'tag:yaml.org,2002:float',
+    'tag:yaml.org,2002:str'
+}
+
+# Parsed frontmatter by the raw YAML block (`None` if the block is not valid frontmatter).
+frontmatter_cache = LRUCache(FRONTMATTER_CACHE_LIMIT)
+_resolver = yaml.resolver.Resolver()
+_constructor = yaml.constructor.SafeConstructor()
+
 
 def yaml_load(stream, loader=yaml.Loader, object_pairs_hook=OrderedDict):
     """
@@ -42,6 +66,153 @@ def yaml_load(stream, loader=yaml.Loader, object_pairs_hook=OrderedDict):
     return yaml.load(stream, Loader)
 
 
+class UnsupportedYaml(Exception):
+    """YAML that is not understood by the fast loader."""
+
+
+def _load_scalar(text):
+    """Load a single line scalar the way PyYAML would."""
+
+    if text in ('{}', '[]'):
+        return OrderedDict() if text == '{}' else []
+    m = RE_SINGLE_QUOTED.match(text)
+    if m:
+        return m.group(1).replace("''", "'")
+    m = RE_DOUBLE_QUOTED.match(text)
+    if m:
+        return m.group(1)
+    if not RE_PLAIN_SCALAR.match(text):
+        raise UnsupportedYaml(text)
+    tag = _resolver.resolve(yaml.nodes.ScalarNode, text, (True, False))
+    if tag not in PLAIN_TAGS:
+        raise UnsupportedYaml(text)
+    return _constructor.yaml_constructors[tag](_constructor, yaml.nodes.ScalarNode(tag, text))
+
+
+def _load_block(lines, index, indent):
+    """Load the block starting at the line `index`, whose content is at column `indent`."""
+
+    text = lines[index][1]
+    if text == '-' or text.startswith('- '):
+        return _load_sequence(lines, index, indent)
+    if RE_KEY.match(text):
+        return _load_mapping(lines, index, indent)
+    return index + 1, _load_scalar(text)
+
+
+def _load_value(lines, index, indent):
+    """Load the value on the lines following a mapping key or sequence item at column `indent`."""
+
+    if index < len(lines):
+        column, text = lines[index]
+        if column > indent or (column == indent and (text == '-' or text.startswith('- '))):
+            return _load_block(lines, index, column)
+    return index, None
+
+
+def _load_sequence(lines, index, indent):
+    """Load a block sequence."""
+
+    items = []
+    while index < len(lines):
+        column, text = lines[index]
+        if column != indent or not (text == '-' or text.startswith('- ')):
+            break
+        rest = text[1:].lstrip(' ')
+        if rest:
+            # The item's content starts on the same line, so treat it as a block at the content's column.
+            column += len(text) - len(rest)
+            lines[index] = (column, rest)
+            index, value = _load_block(lines, index, column)
+        else:
+            index, value = _load_value(lines, index + 1, indent + 1)
+        items.append(value)
+    return index, items
+
+
+def _load_mapping(lines, index, indent):
+    """Load a block mapping."""
+
+    mapping = OrderedDict()
+    while index < len(lines):
+        column, text = lines[index]
+        if column != indent:
+            break
+        m = RE_KEY.match(text)
+        if m is None:
+            raise UnsupportedYaml(text)
+        if m.group(1) is not None:
+            key = m.group(1).replace("''", "'")
+        elif m.group(2) is not None:
+            key = m.group(2)
+        else:
+            key = _load_scalar(m.group(3))
+        if m.group(4):
+            index, value = index + 1, _load_scalar(m.group(4))
+        else:
+            index, value = _load_value(lines, index + 1, indent)
+        mapping[key] = value
+    return index, mapping
+
+
+def fast_yaml_load(stream):
+    """
+    Load the simple YAML that `dump_frontmatter` creates.
+
+    Only block mappings and sequences of single line scalars are understood.
+    `UnsupportedYaml` is raised for anything else (multi-line scalars, flow collections,
+    anchors, tags, etc.), in which case the full `yaml_load` should be used.
+    """
+
+    lines = []
+    for line in stream.splitlines():
+        if '\t' in line:
+            raise UnsupportedYaml(line)
+        text = line.lstrip(' ')
+        if not text or text.startswith('#'):
+            continue
+        if line.startswith(('---', '...')):
+            # Document markers
+            raise UnsupportedYaml(line)
+        lines.append((len(line) - len(text), text.rstrip(' ')))
+    if not lines:
+        return None
+
+    index, value = _load_block(lines, 0, lines[0][0])
+    if index != len(lines):
+        raise UnsupportedYaml(lines[index][1])
+    return value
+
+
+def _copy(obj):
+    """Copy loaded frontmatter, so the cached version is never changed."""
+
+    if isinstance(obj, dict):
+        return obj.__class__((k, _copy(v)) for k, v in obj.items())
+    elif isinstance(obj, list):
+        return [_copy(v) for v in obj]
+    elif obj is None or isinstance(obj, (str, int, float)):
+        return obj
+    return copy.deepcopy(obj)
+
+
+def load_frontmatter(text):
+    """Load the YAML of a frontmatter block, returning `None` if it is not a dictionary."""
+
+    try:
+        try:
+            frontmatter = fast_yaml_load(text)
+        except UnsupportedYaml:
+            frontmatter = yaml_load(text)
+    except Exception:
+        # We had a parsing error. This is not the YAML we are looking for.
+        return None
+    if frontmatter is None:
+        frontmatter = OrderedDict()
+    # If we didn't get a dictionary, we don't want this as it isn't frontmatter.
+    return frontmatter if isinstance(frontmatter, dict) else None
+
+
 def yaml_dump(data, stream=None, dumper=yaml.Dumper):
     """Special dumper wrapper to modify the YAML dumper."""
 
@@ -64,25 +235,24 @@ def dump_frontmatter(values):
 
 
 def get_frontmatter(string):
-    """Get frontmatter from string."""
+    """
+    Get frontmatter from string.
+
+    Parsed frontmatter is cached by its raw YAML, and a copy is returned, so it is safe to modify.
+    """
 
     frontmatter = OrderedDict()
 
     if string.startswith("---"):
-        m = re.search(r'^(-{3}\r?\n(?!\r?\n)(.*?)(?<=\n)(?:-{3}|\.{3})\r?\n)', string, re.DOTALL)
+        m = RE_FRONTMATTER.search(string)
         if m:
-            yaml_okay = True
-            try:
-                frontmatter = yaml_load(m.group(2))
-                if frontmatter is None:
-                    frontmatter = OrderedDict()
-                # If we didn't get a dictionary, we don't want this as it isn't frontmatter.
-                assert isinstance(frontmatter, (dict, OrderedDict)), TypeError
-            except Exception:
-                # We had a parsing error. This is not the YAML we are looking for.
-                yaml_okay = False
-                frontmatter = OrderedDict()
-            if yaml_okay:
+            block = m.group(2)
+            value = frontmatter_cache.get(block, False)
+            if value is False:
+                value = load_frontmatter(block)
+                frontmatter_cache.set(block, value)
+            if value is not None:
+                frontmatter = _copy(value)
                 string = string[m.end(1):]
 
     return frontmatter, string
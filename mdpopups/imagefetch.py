@@ -0,0 +1,426 @@
+"""
+Remote image fetching.
+
+Downloads are run on a bounded pool of threads. Each thread keeps a keep-alive
+connection per host, so multiple images from the same host reuse connections.
+
+Licensed under MIT
+Copyright (c) 2015 - 2020 Isaac Muse <isaacmuse@gmail.com>
+"""
+from . import version as ver
+from .cache import DiskCache, LRUCache
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import http.client
+import json
+import re
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+FETCH_LIMIT = 4
+FETCH_TIMEOUT = 10
+MAX_REDIRECTS = 5
+MAX_PAYLOAD = 32 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+REDIRECTS = (301, 302, 303, 307, 308)
+
+IMAGE_CACHE_BUDGET = 20 * 1024 * 1024
+IMAGE_CACHE_FRESH = 60 * 60
+FAILURE_CACHE_LIMIT = 100
+FAILURE_TTL = 5 * 60
+
+RE_MAX_AGE = re.compile(r'max-age\s*=\s*"?(\d+)', re.I)
+
+
+def get_max_age(response):
+    """
+    Get how long the response may be used without revalidating it from the `Cache-Control` header.
+
+    Returns `None` if the response should not be stored, and `-1` if the header does not say.
+    """
+
+    control = (response.getheader('cache-control') or '').lower()
+    if 'no-store' in control:
+        return None
+    if 'no-cache' in control:
+        return 0
+    m = RE_MAX_AGE.search(control)
+    return int(m.group(1)) if m else -1
+
+
+class FetchError(Exception):
+    """Image could not be fetched."""
+
+
+class FetchCancelled(Exception):
+    """Image download was cancelled."""
+
+
+class ImageCache(object):
+    """
+    Remote images stored on disk, in base64 ready to be spliced into HTML.
+
+    Entries record the `ETag` and `Last-Modified` validators of the response,
+    so stale entries can be revalidated instead of downloaded again. Entries
+    are considered fresh for the `max-age` of the response, or `fresh` seconds
+    if it has none. The disk usage is bounded by `budget` bytes, evicting the
+    least recently used images. Failed downloads are remembered in memory for
+    `failure_ttl` seconds, so they are not retried on every render.
+    """
+
+    def __init__(self, path, budget=IMAGE_CACHE_BUDGET, fresh=IMAGE_CACHE_FRESH, failure_ttl=FAILURE_TTL):
+        """Initialize."""
+
+        self.disk = DiskCache(path, budget)
+        self.fresh = fresh
+        self.failure_ttl = failure_ttl
+        self.failures = LRUCache(FAILURE_CACHE_LIMIT)
+
+    def get(self, url):
+        """
+        Get the cached entry for the URL.
+
+        The entry is a dictionary with the base64 `data`, `mime`, `etag`, `modified`, and `expires` time.
+        """
+
+        value = self.disk.get(url)
+        if value is None:
+            return None
+        header, _, data = value.partition(b'\n')
+        try:
+            entry = json.loads(header.decode('utf-8'))
+        except ValueError:
+            return None
+        entry['data'] = data.decode('ascii')
+        return entry
+
+    @staticmethod
+    def is_fresh(entry):
+        """Check if the entry can be used without revalidating it."""
+
+        return time.time() < entry['expires']
+
+    def set(self, url, data, mime, etag=None, modified=None, max_age=-1):
+        """Store the base64 `data` of an image. See `get_max_age` for `max_age`."""
+
+        if max_age is None or self.disk.budget <= 0:
+            return
+        header = {
+            'mime': mime,
+            'etag': etag,
+            'modified': modified,
+            'expires': time.time() + (self.fresh if max_age < 0 else max_age)
+        }
+        self.disk.set(url, json.dumps(header).encode('utf-8') + b'\n' + data.encode('ascii'))
+        self.failures.pop(url)
+
+    def revalidated(self, url, entry, max_age=-1):
+        """Mark the entry as fresh again after the server confirmed it is unchanged."""
+
+        self.set(url, entry['data'], entry['mime'], entry['etag'], entry['modified'], max_age)
+
+    def fail(self, url, exception):
+        """Remember a failed download."""
+
+        self.failures.set(url, (time.time() + self.failure_ttl, exception))
+
+    def failure(self, url):
+        """Get the exception of a recently failed download of the URL."""
+
+        value = self.failures.get(url)
+        if value is None:
+            return None
+        if time.time() >= value[0]:
+            self.failures.pop(url)
+            return None
+        return value[1]
+
+    def clear(self):
+        """Clear the cache."""
+
+        self.disk.clear()
+        self.failures.clear()
+
+    def clear_failures(self):
+        """Forget failed downloads, so they are retried."""
+
+        self.failures.clear()
+
+    def stats(self):
+        """Return cache statistics."""
+
+        return self.disk.stats()
+
+
+class FetchRequest(object):
+    """A queued or running image download that can be cancelled."""
+
+    def __init__(self, url, done):
+        """Initialize."""
+
+        self.url = url
+        self.done = done
+        self.future = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Cancel the download. The `done` callback will not be called once cancelled."""
+
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def is_cancelled(self):
+        """Check if the download was cancelled."""
+
+        return self._cancelled.is_set()
+
+
+class ImageFetcher(object):
+    """
+    Download images on a bounded pool of threads.
+
+    `limit` is the maximum number of concurrent downloads and `timeout` is the
+    socket timeout in seconds. Connections are kept alive and reused per host
+    (and per thread); if the server has closed a reused connection, the request
+    is retried once on a new connection. If an `ImageCache` is given, downloads
+    are stored in it and cached images are revalidated with conditional requests.
+
+    Proxies are configured like `urllib`, from `urllib.request.getproxies()`
+    (such as the `HTTP_PROXY`, `HTTPS_PROXY`, and `NO_PROXY` environment variables).
+    HTTPS requests are tunneled through the proxy with `CONNECT`.
+    """
+
+    def __init__(self, limit=FETCH_LIMIT, timeout=FETCH_TIMEOUT, cache=None):
+        """Initialize."""
+
+        self.limit = limit
+        self.timeout = timeout
+        self.cache = cache
+        self.headers = {
+            'User-Agent': 'mdpopups/{}'.format(ver.version()),
+            'Accept': 'image/*',
+            'Connection': 'keep-alive'
+        }
+        self._executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix='mdpopups-fetch')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._ssl_context = None
+
+    def fetch(self, url, done):
+        """
+        Queue a download of `url`.
+
+        `done` is called from a pool thread with `(data, mime, exception)`,
+        the same as a resolver's callback. Returns a `FetchRequest`.
+        """
+
+        request = FetchRequest(url, done)
+        request.future = self._executor.submit(self._run, request)
+        return request
+
+    def close(self):
+        """Stop accepting downloads and close all connections."""
+
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+
+    def _run(self, request):
+        """Run a download."""
+
+        if request.is_cancelled():
+            return
+        try:
+            data, mime = self.retrieve(request.url, request)
+        except Exception as e:
+            if not request.is_cancelled():
+                request.done(None, None, e)
+            return
+        if not request.is_cancelled():
+            request.done(data, mime, None)
+
+    def retrieve(self, url, request=None):
+        """
+        Download `url`, following redirects, and return the payload and its mime type.
+
+        If a `FetchRequest` is given, the download stops if it is cancelled.
+        """
+
+        original = url
+        entry = self.cache.get(url) if self.cache is not None else None
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['modified']:
+                headers['If-Modified-Since'] = entry['modified']
+
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise FetchError("unsupported URL scheme '{}'".format(parts.scheme))
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            key = (parts.scheme, parts.netloc)
+            if self._proxy(key) is not None and parts.scheme == 'http':
+                # Plain HTTP proxies expect the absolute URL.
+                path = '{}://{}{}'.format(parts.scheme, parts.netloc, path)
+            response = self._request(key, path, headers)
+            try:
+                if response.status in REDIRECTS:
+                    location = response.getheader('location')
+                    response.read()
+                    if not location:
+                        raise FetchError('redirect without a location for {}'.format(url))
+                    url = urllib.parse.urljoin(url, location)
+                    continue
+                if response.status == 304 and entry is not None:
+                    response.read()
+                    self.cache.revalidated(original, entry, get_max_age(response))
+                    return base64.b64decode(entry['data']), entry['mime']
+                if response.status != 200:
+                    response.read()
+                    raise FetchError('HTTP {} {} for {}'.format(response.status, response.reason, url))
+                data, mime = self._read(response, request)
+            except FetchError:
+                raise
+            except Exception:
+                # The connection is in an unknown state, so don't reuse it.
+                self._discard(key)
+                raise
+            if self.cache is not None:
+                self.cache.set(
+                    original, base64.b64encode(data).decode('ascii'), mime,
+                    response.getheader('etag'), response.getheader('last-modified'), get_max_age(response)
+                )
+            return data, mime
+        raise FetchError('too many redirects for {}'.format(url))
+
+    def _read(self, response, request=None):
+        """
+        Read the payload of a response.
+
+        The payload is read in chunks, so responses without a `Content-Length`
+        (such as chunked responses) can be limited as they are read.
+        """
+
+        # We provide some basic protection against absurdly large images.
+        # 32MB is chosen as an arbitrary upper limit. This can be raised if desired.
+        length = response.getheader('content-length')
+        if length is not None and int(length) >= MAX_PAYLOAD:
+            raise ValueError("refusing to read payloads larger than or equal to 32MB")
+        mime = response.getheader('content-type', 'image/png').lower()
+
+        data = bytearray()
+        while True:
+            if request is not None and request.is_cancelled():
+                raise FetchCancelled('download of {} was cancelled'.format(request.url))
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data += chunk
+            if len(data) >= MAX_PAYLOAD:
+                raise ValueError("refusing to read payloads larger than or equal to 32MB")
+        if not data:
+            raise ValueError("empty payload")
+        return bytes(data), mime
+
+    def _request(self, key, path, headers=None):
+        """Send a request on the thread's connection for the host, reconnecting once if it went stale."""
+
+        proxy = self._proxy(key)
+        if proxy is not None and key[0] == 'http' and proxy[1]:
+            headers = dict(headers or {}, **proxy[1])
+        if headers:
+            headers = dict(self.headers, **headers)
+        else:
+            headers = self.headers
+        for attempt in range(2):
+            conn = self._connection(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                return conn.getresponse()
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionError):
+                self._discard(key)
+                if attempt:
+                    raise
+            except Exception:
+                self._discard(key)
+                raise
+
+    def _proxy(self, key):
+        """
+        Get the proxy for the host as `(netloc, headers)`, or `None` if it is not proxied.
+
+        The calling thread's choice is remembered with its connections, so proxies are only looked up per connection.
+        """
+
+        proxies = getattr(self._local, 'proxies', None)
+        if proxies is None:
+            proxies = self._local.proxies = {}
+        if key not in proxies:
+            scheme, netloc = key
+            proxy = urllib.request.getproxies().get(scheme)
+            host = urllib.parse.urlsplit('//' + netloc).hostname or ''
+            if proxy and not urllib.request.proxy_bypass(host):
+                if '://' not in proxy:
+                    proxy = 'http://' + proxy
+                parts = urllib.parse.urlsplit(proxy)
+                headers = {}
+                if parts.username is not None:
+                    credentials = '{}:{}'.format(
+                        urllib.parse.unquote(parts.username), urllib.parse.unquote(parts.password or '')
+                    )
+                    headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(
+                        credentials.encode('utf-8')
+                    ).decode('ascii')
+                proxies[key] = ('{}:{}'.format(parts.hostname, parts.port or 80), headers)
+            else:
+                proxies[key] = None
+        return proxies[key]
+
+    def _connection(self, key):
+        """Get the calling thread's connection for the host."""
+
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(key)
+        if conn is None:
+            scheme, netloc = key
+            proxy = self._proxy(key)
+            if scheme == 'https':
+                if self._ssl_context is None:
+                    self._ssl_context = ssl.create_default_context()
+                if proxy is not None:
+                    conn = http.client.HTTPSConnection(proxy[0], timeout=self.timeout, context=self._ssl_context)
+                    conn.set_tunnel(netloc, headers=proxy[1])
+                else:
+                    conn = http.client.HTTPSConnection(netloc, timeout=self.timeout, context=self._ssl_context)
+            elif proxy is not None:
+                conn = http.client.HTTPConnection(proxy[0], timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            connections[key] = conn
+            with self._lock:
+                self._connections.add(conn)
+        return conn
+
+    def _discard(self, key):
+        """Close and forget the calling thread's connection for the host."""
+
+        conn = getattr(self._local, 'connections', {}).pop(key, None)
+        if conn is not None:
+            conn.close()
+            with self._lock:
+                self._connections.discard(conn)
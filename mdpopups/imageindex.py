@@ -0,0 +1,219 @@
+"""
+Index of remote images in minihtml.
+
+The minihtml is tokenized in a single pass: only `<` is searched for, and
+comments, `script`/`style` blocks, and `img` tags are consumed as they are
+found. The offsets of the `src` values of remote images are recorded so they
+can be spliced without scanning again, and when the document changes, only the
+changed part is scanned again.
+
+Licensed under MIT
+Copyright (c) 2015 - 2020 Isaac Muse <isaacmuse@gmail.com>
+"""
+import bisect
+import html
+import re
+import urllib.parse
+
+RE_OPEN = re.compile(r'<\s*(img|script|style)')
+RE_SPACE = re.compile(r'\s*')
+RE_ATTR = re.compile(r'''\s+([\w\-:]+)(?:\s*=\s*("[^"]*"|'[^']*'))?''')
+RE_CLOSE = re.compile(r'\s*/?>')
+RE_AVOID_END = {
+    'script': re.compile(r'</\s*script\s*>'),
+    'style': re.compile(r'</\s*style\s*>')
+}
+
+# How far past the start of a `<` that is not an `img`, `script`, or `style` tag is looked at.
+MAX_OPEN_LOOKAHEAD = len('<script')
+
+
+def evaluate(text, start):
+    """
+    Evaluate the `<` at `start`.
+
+    Returns `(end, image)` if a comment, `script`/`style` block, or `img` tag starts there, where `image`
+    is `(src_start, src_end, url)` for remote images and `None` otherwise. If nothing starts there,
+    `(None, furthest)` is returned, where `furthest` is the position up to which the text was looked at.
+    """
+
+    if text.startswith('<!--', start):
+        end = text.find('-->', start + 4)
+        if end == -1:
+            return None, len(text)
+        return end + 3, None
+
+    m = RE_OPEN.match(text, start)
+    if m is None:
+        return None, RE_SPACE.match(text, start + 1).end() + MAX_OPEN_LOOKAHEAD
+
+    name = m.group(1)
+    if name != 'img':
+        close = text.find('>', m.end())
+        end = RE_AVOID_END[name].search(text, close + 1) if close != -1 else None
+        if end is None:
+            return None, len(text)
+        return end.end(), None
+
+    pos = m.end()
+    src = None
+    while True:
+        attr = RE_ATTR.match(text, pos)
+        if attr is None:
+            break
+        if src is None and attr.group(1) == 'src' and attr.group(2):
+            src = attr.span(2)
+        pos = attr.end()
+    close = RE_CLOSE.match(text, pos)
+    if close is None:
+        # An unterminated quote may have been looked for up to the end.
+        return None, len(text)
+
+    image = None
+    if src is not None:
+        url = html.unescape(text[src[0] + 1:src[1] - 1])
+        if urllib.parse.urlparse(url).scheme in ("http", "https"):
+            image = (src[0] + 1, src[1] - 1, url)
+    return close.end(), image
+
+
+def scan(text, pos=0, stop=None):
+    """
+    Scan `text` starting at `pos`, which must not be inside of a tag, comment, or block.
+
+    `stop` is called with the position of each `<` before it is evaluated, and scanning stops if it returns `True`.
+    Returns the found `blocks` as `(start, end, image)`, the `failures` as `(start, furthest)` for each `<` where
+    nothing started, and the position where scanning stopped.
+    """
+
+    blocks = []
+    failures = []
+    find = text.find
+    while True:
+        start = find('<', pos)
+        if start == -1:
+            return blocks, failures, len(text)
+        if stop is not None and stop(start):
+            return blocks, failures, start
+        end, value = evaluate(text, start)
+        if end is None:
+            failures.append((start, value))
+            pos = start + 1
+        else:
+            blocks.append((start, end, value))
+            pos = end
+
+
+def common_prefix(a, b):
+    """Get the length of the common prefix of two strings."""
+
+    lo = 0
+    hi = min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def common_suffix(a, b, limit):
+    """Get the length of the common suffix of two strings, up to `limit`."""
+
+    la = len(a)
+    lb = len(b)
+    lo = 0
+    hi = limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[la - mid:la - lo] == b[lb - mid:lb - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class ImageIndex(object):
+    """The offsets of the `src` values of remote images in a minihtml buffer."""
+
+    def __init__(self, text):
+        """Initialize."""
+
+        self.text = text
+        self.blocks, self.failures, _ = scan(text)
+        self.starts = [block[0] for block in self.blocks]
+
+    def inside(self, pos):
+        """Check if the position is inside of a tag, comment, or block."""
+
+        index = bisect.bisect_right(self.starts, pos) - 1
+        return index >= 0 and self.blocks[index][0] < pos < self.blocks[index][1]
+
+    def update(self, text):
+        """
+        Update the index for a new version of the text.
+
+        Only the part of the text between the common prefix and suffix of the old and new text is scanned again,
+        along with any tag that overlaps it. Once scanning is past the change and in step with the old scan, the
+        rest of the old index is reused with its offsets shifted.
+        """
+
+        old = self.text
+        if text == old:
+            return self
+
+        prefix = common_prefix(old, text)
+        suffix = common_suffix(old, text, min(len(old), len(text)) - prefix)
+        delta = len(text) - len(old)
+        changed_end = len(text) - suffix
+
+        # Start at the tag containing the change, or at any `<` before it that looked into the change.
+        restart = prefix
+        index = bisect.bisect_right(self.starts, prefix) - 1
+        if index >= 0 and self.blocks[index][1] > prefix:
+            restart = self.blocks[index][0]
+        for start, furthest in self.failures:
+            if start >= restart:
+                break
+            if furthest >= prefix:
+                restart = start
+                break
+
+        def stop(pos):
+            """Stop once past the change at a position that the old scan would also have reached."""
+
+            return pos >= changed_end and not self.inside(pos - delta)
+
+        blocks, failures, pos = scan(text, restart, stop)
+        resume = pos - delta
+
+        self.blocks = (
+            [block for block in self.blocks if block[0] < restart] +
+            blocks +
+            [
+                (start + delta, end + delta, (image[0] + delta, image[1] + delta, image[2]) if image else None)
+                for start, end, image in self.blocks if start >= resume
+            ]
+        )
+        self.failures = (
+            [failure for failure in self.failures if failure[0] < restart] +
+            failures +
+            [(start + delta, furthest + delta) for start, furthest in self.failures if start >= resume]
+        )
+        self.starts = [block[0] for block in self.blocks]
+        self.text = text
+        return self
+
+    def spans(self):
+        """Get the `(src_start, src_end, url)` of each remote image in order."""
+
+        return [block[2] for block in self.blocks if block[2] is not None]
+
+    def images(self):
+        """Get the `(src_start, src_end)` offsets of each remote image by URL."""
+
+        images = {}
+        for start, end, url in self.spans():
+            images.setdefault(url, []).append((start, end))
+        return images
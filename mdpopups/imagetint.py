@@ -7,21 +7,77 @@ Copyright (c) 2015 - 2020 Isaac Muse <isaacmuse@gmail.com>
 from .png import Reader, Writer
 from .coloraide import Color
 from .coloraide import algebra as alg
+from .coloraide.compositing.porter_duff import SourceOver
+from .cache import LRUCache
+from .colorbox import color_key, COMPRESSION_LEVEL
+from array import array
 import base64
+import hashlib
 import io
+import itertools
 
+# Hex channels are parsed by scaling with this factor, so the lookup tables must use it as well.
+RGB_CHANNEL_SCALE = 1.0 / 255.0
+TINT_CACHE_LIMIT = 100
+TABLE_CACHE_LIMIT = 20
 
-def tint_raw(byte_string, color, opacity=255):
-    """Tint the image and return a byte string."""
+# Finished tinted images (raw bytes or `img` tags) keyed by a digest of the source image and the tint options.
+tint_cache = LRUCache(TINT_CACHE_LIMIT, sizeof=len)
 
-    # Read the byte string as a RGBA image.
-    width, height, pixels, _ = Reader(bytes=byte_string).asRGBA()
+# Channel lookup tables keyed by tint color and opacity.
+table_cache = LRUCache(TABLE_CACHE_LIMIT)
+
+
+def tint_key(byte_string, color, opacity, *args):
+    """Get the cache key for a tinted image."""
+
+    return (hashlib.sha1(byte_string).hexdigest(), color_key(color), opacity) + args
+
+
+def clamp_opacity(opacity):
+    """Clamp opacity."""
 
-    # Clamp opacity
     if opacity < 0:
         opacity = 0
     elif opacity > 255:
         opacity = 255
+    return opacity
+
+
+def build_tables(color, opacity):
+    """
+    Build a 256 entry lookup table for each color channel.
+
+    Compositing the tint over an opaque pixel in sRGB affects each channel independently,
+    so the result for each possible channel value can be computed up front. Returns `None`
+    if the tint is outside the sRGB gamut, as the result must then be gamut mapped as a whole.
+    """
+
+    key = (color_key(color), opacity)
+    tables = table_cache.get(key, False)
+    if tables is not False:
+        return tables
+
+    rgba = Color(color).convert('srgb').normalize(nans=False)
+    if not rgba.in_gamut(tolerance=0):
+        table_cache.set(key, None)
+        return None
+
+    alpha = opacity / 255.0
+    compositor = SourceOver(1.0, alpha)
+    tables = [
+        bytes(
+            int(alg.round_half_up(alg.clamp(compositor.co(cb * RGB_CHANNEL_SCALE, cs), 0.0, 1.0) * 255))
+            for cb in range(256)
+        )
+        for cs in rgba[:-1]
+    ]
+    table_cache.set(key, tables)
+    return tables
+
+
+def tint_rows_reference(pixels, color, opacity):
+    """Tint the pixel rows by compositing each pixel with color objects."""
 
     # Tint
     p = []
@@ -43,13 +99,58 @@ def tint_raw(byte_string, color, opacity=255):
             ]
             start += 4
         y += 1
+    return p
+
+
+def tint_pixels(pixels, tables):
+    """Tint a flat buffer of 8 bit RGBA pixels in place by translating each channel through its lookup table."""
+
+    red, green, blue = tables
+    pixels[0::4] = pixels[0::4].translate(red)
+    pixels[1::4] = pixels[1::4].translate(green)
+    pixels[2::4] = pixels[2::4].translate(blue)
+    return pixels
+
+
+def tint_raw(byte_string, color, opacity=255, reference=False):
+    """
+    Tint the image and return a byte string.
+
+    Images are tinted with lookup tables. The slower, color object based
+    compositing is used for tints outside of sRGB, or when `reference` is enabled.
+    """
+
+    # Clamp opacity
+    opacity = clamp_opacity(opacity)
+
+    key = tint_key(byte_string, color, opacity, 'raw', reference)
+    data = tint_cache.get(key)
+    if data is None:
+        data = _tint_raw(byte_string, color, opacity, reference)
+        tint_cache.set(key, data)
+    return data
+
+
+def _tint_raw(byte_string, color, opacity, reference=False):
+    """Tint the image and return a byte string."""
+
+    # Read the byte string as a flat buffer of 8 bit RGBA pixels.
+    width, height, pixels, _ = Reader(bytes=byte_string).read_rgba8()
+
+    tables = None if reference else build_tables(color, opacity)
+    if tables is None:
+        stride = width * 4
+        rows = (pixels[i:i + stride] for i in range(0, len(pixels), stride))
+        data = array('B', itertools.chain.from_iterable(tint_rows_reference(rows, color, opacity)))
+    else:
+        data = tint_pixels(pixels, tables)
 
     # Create bytes buffer for PNG
     with io.BytesIO() as f:
 
         # Write out PNG
-        img = Writer(width, height, alpha=True)
-        img.write(f, p)
+        img = Writer(width, height, alpha=True, compression=COMPRESSION_LEVEL)
+        img.write_buffer(f, data)
 
         # Read out PNG bytes and base64 encode
         f.seek(0)
@@ -60,6 +161,13 @@ def tint_raw(byte_string, color, opacity=255):
 def tint(byte_string, color, opacity=255, height=None, width=None):
     """Base64 encode the tint."""
 
+    opacity = clamp_opacity(opacity)
+
+    key = tint_key(byte_string, color, opacity, height, width)
+    html = tint_cache.get(key)
+    if html is not None:
+        return html
+
     style = ''
     if width:
         style = 'style="width: {:d}px;"'.format(width)
@@ -68,7 +176,9 @@ def tint(byte_string, color, opacity=255, height=None, width=None):
     elif height is not None:
         style = style[:-1] + (' height: {:d}px;" '.format(height))
 
-    return '<img {}src="data:image/png;base64,{}">'.format(
+    html = '<img {}src="data:image/png;base64,{}">'.format(
         style,
-        base64.b64encode(tint_raw(byte_string, color, opacity)).decode('ascii')
+        base64.b64encode(_tint_raw(byte_string, color, opacity)).decode('ascii')
     )
+    tint_cache.set(key, html)
+    return html
@@ -29,6 +29,7 @@ from ..st_pygments_highlight import (
     replace_nbsp,
     multi_space
 )
+from ..cache import fragment_cache
 from ..markdown import Extension
 from ..markdown.treeprocessors import Treeprocessor
 import xml.etree.ElementTree as etree
@@ -249,6 +250,43 @@ class Highlight:
         self, src, language, css_class='highlight', hl_lines=None,
         linestart=-1, linestep=-1, linespecial=-1, inline=False, classes=None, id_value='', attrs=None,
         title=None, code_block_count=0
+    ):
+        """Highlight code and cache the Pygments results (Sublime highlighter results are cached by the highlighter)."""
+
+        args = (
+            src, language, css_class, hl_lines, linestart, linestep, linespecial, inline, classes, id_value, attrs,
+            title, code_block_count
+        )
+        if self.sublime_hl[0] or not (pygments and self.use_pygments):
+            return self._highlight(*args)
+
+        key = (
+            'pygments', src, language, css_class, tuple(hl_lines) if hl_lines else (), linestart, linestep,
+            linespecial, inline, tuple(classes) if classes else (), id_value, repr(attrs), title,
+            # The count is only used for line IDs
+            code_block_count if self.line_spans or self.line_anchors else 0,
+            self.pygments_style, self.noclasses, self.linenums, self.linenums_style, self.linenums_special,
+            self.language_prefix, self.auto_title, repr(self.auto_title_map), self.line_spans, self.line_anchors,
+            self.anchor_linenums, self.pygments_lang_class, self.stripnl, self.default_lang, self.guess_lang,
+            repr(self.extend_pygments_lang), self.sublime_wrap
+        )
+        value = fragment_cache.get(key)
+        if value is None:
+            value = self._highlight(*args)
+            if inline:
+                value = (dict(value.attrib), value.text)
+            fragment_cache.set(key, value)
+
+        if inline:
+            el = etree.Element('code', value[0])
+            el.text = value[1]
+            return el
+        return value
+
+    def _highlight(
+        self, src, language, css_class='highlight', hl_lines=None,
+        linestart=-1, linestep=-1, linespecial=-1, inline=False, classes=None, id_value='', attrs=None,
+        title=None, code_block_count=0
     ):
         """Highlight code."""
 
@@ -844,6 +844,78 @@ class Writer:
               self.rescale[0])
         return self.write_passes(outfile, rows, packed=True)
 
+    def write_buffer(self, outfile, data):
+        """
+        Write PNG file to `outfile`.  The pixel data comes from `data`,
+        which should be a single contiguous buffer (``bytes``,
+        ``bytearray``, ``array('B')`` or ``memoryview``) holding all of
+        the rows in packed format, one after another.
+
+        This is a fast path for the small 8-bit (or 16-bit big endian)
+        RGB and RGBA images that are generated on the fly: every scanline
+        uses filter type 0 and the whole image is compressed with a
+        single call to zlib, using `compression` as the level.  Images
+        that need any other processing (palettes, interlacing, rescaling,
+        or ancillary chunks) are passed on to :meth:`write_passes`.
+        """
+
+        # Rows of less than 8 bits per sample are padded to a whole byte.
+        stride = (self.width * self.planes * self.bitdepth + 7) // 8
+        data = memoryview(data).cast('B')
+        if len(data) != stride * self.height:
+            raise ValueError(
+              "buffer size (%d) does not match image size (%d)" %
+              (len(data), stride * self.height))
+
+        if self.interlace or self.rescale:
+            # Interlacing and rescaling work on pixel values, not bytes.
+            self.write_array(outfile, self.buffer_to_flat(data, stride))
+            return self.height
+
+        if (self.bitdepth not in (8, 16) or self.palette or
+                self.gamma is not None or
+                self.transparent is not None or self.background is not None):
+            return self.write_passes(
+              outfile,
+              (data[i:i + stride] for i in range(0, len(data), stride)),
+              packed=True)
+
+        # Prefix each scanline with the "None" filter type.
+        raw = bytearray((stride + 1) * self.height)
+        for y in range(self.height):
+            start = y * (stride + 1)
+            raw[start + 1:start + 1 + stride] = data[y * stride:(y + 1) * stride]
+
+        level = -1 if self.compression is None else self.compression
+        write_chunks(outfile, [
+            ('IHDR', struct.pack("!2I5B", self.width, self.height,
+                                 self.bitdepth, self.color_type, 0, 0, 0)),
+            ('IDAT', zlib.compress(raw, level)),
+            ('IEND', strtobytes(''))
+        ])
+        return self.height
+
+    def buffer_to_flat(self, data, stride):
+        """
+        Convert a buffer of packed rows, as given to
+        :meth:`write_buffer`, to flat row flat pixel format.
+        """
+
+        if self.bitdepth == 8:
+            return array('B', data)
+        if self.bitdepth == 16:
+            return array('H', struct.unpack('!%dH' % (len(data)//2), data))
+        # Samples per byte
+        spb = 8 // self.bitdepth
+        mask = 2**self.bitdepth - 1
+        shifts = [self.bitdepth * i for i in reversed(range(spb))]
+        vpr = self.width * self.planes
+        pixels = array('B')
+        for start in range(0, len(data), stride):
+            row = [mask & (o >> s) for o in data[start:start + stride] for s in shifts]
+            pixels.extend(row[:vpr])
+        return pixels
+
     def convert_pnm(self, infile, outfile):
         """
         Convert a PNM file containing raw pixel data into a PNG file
@@ -1932,6 +2004,139 @@ class Reader:
         pixel = array(arraycode, itertools.chain(*pixel))
         return x, y, pixel, meta
 
+    def read_rgba8(self):
+        """
+        Read a PNG file and decode it into 8-bit RGBA pixels.  Returns
+        (*width*, *height*, *pixels*, *metadata*) like :meth:`asRGBA8`,
+        except that *pixels* is a single flat ``bytearray`` of all the
+        rows, so it can be processed (and sliced per channel) without
+        creating any per row or per pixel objects.
+
+        Straightlaced 8-bit images, which covers nearly all icons, are
+        decoded directly: the ``IDAT`` data is decompressed in one go and
+        the scanlines are unfiltered in place with loops that avoid the
+        overhead of :meth:`undo_filter`.  Other images are decoded with
+        :meth:`asRGBA8` and flattened.
+        """
+
+        self.preamble()
+        if (self.bitdepth != 8 or self.interlace or self.sbit or
+                (self.trns and not self.colormap)):
+            width, height, pixels, meta = self.asRGBA8()
+            return width, height, bytearray(itertools.chain.from_iterable(pixels)), meta
+
+        if self.colormap and not self.plte:
+            raise FormatError(
+                "Required PLTE chunk is missing in colour type 3 image.")
+
+        idat = []
+        while True:
+            try:
+                type, data = self.chunk()
+            except ValueError as e:
+                raise ChunkError(e.args[0])
+            if type == 'IEND':
+                break
+            if type == 'IDAT':
+                idat.append(data)
+
+        raw = zlib.decompress(strtobytes('').join(idat))
+        pixels = self.unfilter(raw, self.row_bytes, self.psize, self.height)
+
+        count = self.width * self.height
+        if self.color_type == 6:
+            rgba = pixels
+        else:
+            rgba = bytearray(count * 4)
+            if self.colormap:
+                palette = self.palette()
+                for i in range(4):
+                    table = bytearray(256)
+                    table[:len(palette)] = bytes(
+                        entry[i] if i < len(entry) else 0xff
+                        for entry in palette)
+                    rgba[i::4] = pixels.translate(table)
+            else:
+                if self.greyscale:
+                    red = green = blue = pixels[0::self.planes]
+                else:
+                    red, green, blue = pixels[0::3], pixels[1::3], pixels[2::3]
+                rgba[0::4] = red
+                rgba[1::4] = green
+                rgba[2::4] = blue
+                rgba[3::4] = pixels[1::2] if self.alpha else b'\xff' * count
+
+        meta = dict(greyscale=False, alpha=True, planes=4, bitdepth=8,
+                    interlace=0, size=(self.width, self.height))
+        for attr in 'gamma background'.split():
+            a = getattr(self, attr, None)
+            if a is not None:
+                meta[attr] = a
+        return self.width, self.height, rgba, meta
+
+    @staticmethod
+    def unfilter(raw, row_bytes, fu, height):
+        """Undo the filters of all the scanlines of a straightlaced
+        8-bit image in `raw` (each prefixed with its filter type) and
+        return the reconstructed rows as one flat ``bytearray``.
+
+        `fu` is the size of a pixel in bytes.
+        """
+
+        if len(raw) != (row_bytes + 1) * height:
+            raise FormatError('Wrong size for decompressed IDAT chunk.')
+
+        out = bytearray(row_bytes * height)
+        previous = bytes(row_bytes)
+        src = 0
+        dst = 0
+        for _ in range(height):
+            filter_type = raw[src]
+            line = bytearray(raw[src + 1:src + 1 + row_bytes])
+            if filter_type == 1:
+                # Sub: a running sum of each channel.
+                for c in range(fu):
+                    line[c::fu] = bytes(
+                        x & 0xff for x in itertools.accumulate(line[c::fu]))
+            elif filter_type == 2:
+                # Up
+                line = bytearray(
+                    (x + b) & 0xff for x, b in zip(line, previous))
+            elif filter_type == 3:
+                # Average
+                for i in range(fu):
+                    line[i] = (line[i] + (previous[i] >> 1)) & 0xff
+                for i in range(fu, row_bytes):
+                    line[i] = (line[i] +
+                               ((line[i - fu] + previous[i]) >> 1)) & 0xff
+            elif filter_type == 4:
+                # Paeth: `p - a`, `p - b` and `p - c` are simplified to
+                # `b - c`, `a - c` and `a + b - 2c`.
+                for i in range(fu):
+                    line[i] = (line[i] + previous[i]) & 0xff
+                for i in range(fu, row_bytes):
+                    a = line[i - fu]
+                    b = previous[i]
+                    c = previous[i - fu]
+                    pa = abs(b - c)
+                    pb = abs(a - c)
+                    pc = abs(a + b - c - c)
+                    if pa <= pb and pa <= pc:
+                        pr = a
+                    elif pb <= pc:
+                        pr = b
+                    else:
+                        pr = c
+                    line[i] = (line[i] + pr) & 0xff
+            elif filter_type != 0:
+                raise FormatError('Invalid PNG Filter Type.'
+                  '  See http://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters .')
+            out[dst:dst + row_bytes] = line
+            previous = line
+            src += row_bytes + 1
+            dst += row_bytes
+        return out
+
     def palette(self, alpha='natural'):
         """Returns a palette that is a sequence of 3-tuples or 4-tuples,
         synthesizing it from the ``PLTE`` and ``tRNS`` chunks.  These
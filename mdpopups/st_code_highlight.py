@@ -23,9 +23,13 @@ TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR TH
 Original code has been heavily modified by Isaac Muse <isaacmuse@gmail.com> for the `ExportHtml` project.
 """
 import sublime
+import hashlib
 import re
 import os
+import threading
+from collections import OrderedDict
 from .st_mapping import lang_map
+from .cache import fragment_cache
 
 RE_TAIL = re.compile(r'(?:\r\n|(?!\r\n)[\n\r])*\Z')
 
@@ -38,6 +42,278 @@ CODEBG = '<span style="background-color: {highlight}; color: {color};{style}">{c
 BODY_END = '</pre></div>\n'
 INLINE_BODY_END = '</code>'
 ST_LANGUAGES = ('.sublime-syntax', '.tmLanguage')
+VIEW_POOL_SETTING = 'mdpopups.highlight_view_pool_limit'
+USER_MAP_SETTING = 'mdpopups.sublime_user_lang_map'
+VIEW_POOL_LIMIT = 5
+
+
+def run_on_ui_thread(func, *args):
+    """
+    Run `func` on the UI thread and return its result.
+
+    From any other thread, the call is scheduled with `sublime.set_timeout` and the calling thread waits
+    for it to finish. The UI thread never waits for another thread, so plugin callbacks triggered by the
+    call can always run.
+    """
+
+    if threading.current_thread() is threading.main_thread():
+        return func(*args)
+
+    done = threading.Event()
+    result = [None, None]
+
+    def run():
+        """Run the function and hand the result back."""
+
+        try:
+            result[0] = func(*args)
+        except Exception as e:
+            result[1] = e
+        finally:
+            done.set()
+
+    sublime.set_timeout(run)
+    done.wait()
+    if result[1] is not None:
+        raise result[1]
+    return result[0]
+
+
+class ScratchViewPool(object):
+    """
+    Pool of output panels used as scratch views for highlighting.
+
+    Views are kept per window and per syntax, so a view is only set up once and
+    re-highlighting code of the same language only requires its content to be replaced.
+    The least recently used views of a window are destroyed once the pool limit is exceeded.
+
+    Views are shared by the highlighters of all schemes, and filling them runs commands that can trigger
+    plugin callbacks, so views must only be used on the UI thread (see `run_on_ui_thread`).
+    """
+
+    def __init__(self):
+        """Initialize."""
+
+        self.count = 0
+        self.lock = threading.Lock()
+        self.views = OrderedDict()
+
+    def limit(self):
+        """Get the limit of views per window."""
+
+        limit = sublime.load_settings('Preferences.sublime-settings').get(VIEW_POOL_SETTING, VIEW_POOL_LIMIT)
+        if not isinstance(limit, int) or limit < 1:
+            limit = VIEW_POOL_LIMIT
+        return limit
+
+    def acquire(self, window, syntax):
+        """Get a view for the given window and syntax."""
+
+        key = (window.id(), syntax)
+        with self.lock:
+            entry = self.views.get(key)
+            if entry is not None:
+                if entry[1].is_valid():
+                    self.views.move_to_end(key)
+                    return entry[1]
+                del self.views[key]
+
+            self.count += 1
+            name = 'mdpopups-{}'.format(self.count)
+            view = window.create_output_panel(name, unlisted=True)
+            # Let all plugins no to leave this view alone
+            view.settings().set('is_widget', True)
+            # Don't translate anything.
+            view.settings().set("translate_tabs_to_spaces", False)
+            # Don't mess with my indenting Sublime!
+            view.settings().set("auto_indent", False)
+            # Setup the proper syntax
+            if syntax is not None:
+                view.assign_syntax(syntax)
+            self.views[key] = (name, view)
+            self.prune(window)
+            return view
+
+    @staticmethod
+    def fill(view, src):
+        """Replace the entire content of the view with `src` in a single command."""
+
+        view.sel().clear()
+        view.sel().add(sublime.Region(0, view.size()))
+        if src:
+            view.run_command('insert', {'characters': src})
+        elif view.size():
+            # Inserting nothing leaves the selection in place, so empty source has to delete it.
+            view.run_command('right_delete')
+
+    def prune(self, window):
+        """Destroy the least recently used views of the window that exceed the limit."""
+
+        wid = window.id()
+        keys = [k for k in self.views.keys() if k[0] == wid]
+        for key in keys[:max(len(keys) - self.limit(), 0)]:
+            name = self.views.pop(key)[0]
+            window.destroy_output_panel(name)
+
+    def stats(self):
+        """Get pool statistics."""
+
+        with self.lock:
+            return {'size': len(self.views), 'limit': self.limit()}
+
+    def clear(self):
+        """Destroy all pooled views on the UI thread, so a view is never destroyed while it is highlighted."""
+
+        run_on_ui_thread(self._clear)
+
+    def _clear(self):
+        """Destroy all pooled views."""
+
+        with self.lock:
+            for key, entry in self.views.items():
+                window = sublime.Window(key[0])
+                if window.is_valid():
+                    window.destroy_output_panel(entry[0])
+            self.views.clear()
+
+
+scratch_views = ScratchViewPool()
+
+
+class SyntaxIndex(object):
+    """
+    Index of language aliases to syntax files.
+
+    The alias table is built once from the built-in and user language maps and is rebuilt when the user map changes.
+    Resolved syntax paths are remembered per language and plugin map, so the resource system is only consulted the
+    first time a language is seen. Languages that fall back to plain text are not remembered.
+    """
+
+    def __init__(self):
+        """Initialize."""
+
+        self.lock = threading.Lock()
+        self.user_map = None
+        self.aliases = {}
+        self.resolved = {}
+        self.watching = False
+
+    def clear(self):
+        """Clear the index and stop watching the settings."""
+
+        with self.lock:
+            if self.watching:
+                sublime.load_settings('Preferences.sublime-settings').clear_on_change('mdpopups-syntax-index')
+                self.watching = False
+            self.user_map = None
+            self.aliases = {}
+            self.resolved = {}
+
+    def on_settings_change(self):
+        """Invalidate the index if the user language map changed."""
+
+        user_map = sublime.load_settings('Preferences.sublime-settings').get(USER_MAP_SETTING, {})
+        if user_map != self.user_map:
+            self.clear()
+
+    def build(self):
+        """Build the alias table if needed."""
+
+        settings = sublime.load_settings('Preferences.sublime-settings')
+        if not self.watching:
+            settings.add_on_change('mdpopups-syntax-index', self.on_settings_change)
+            self.watching = True
+
+        if self.user_map is None:
+            user_map = settings.get(USER_MAP_SETTING, {})
+            aliases = {}
+            for key in list(user_map.keys()) + [k for k in lang_map.keys() if k not in user_map]:
+                user_v = user_map.get(key, ((), ()))
+                v = lang_map.get(key, ((), ()))
+                for alias in tuple(user_v[0]) + v[0]:
+                    keys = aliases.setdefault(alias, [])
+                    if key not in keys:
+                        keys.append(key)
+            self.aliases = aliases
+            self.resolved = {}
+            self.user_map = user_map
+
+    def resolve(self, lang, plugin_map):
+        """Resolve the language to a syntax file path."""
+
+        cache_key = (lang, repr(plugin_map) if plugin_map else '')
+        with self.lock:
+            self.build()
+            if cache_key in self.resolved:
+                return self.resolved[cache_key]
+            user_map = self.user_map
+            keys = list(self.aliases.get(lang, []))
+
+        for key, value in plugin_map.items():
+            if lang in value[0] and key not in keys:
+                keys.append(key)
+
+        syntax = None
+        for key in keys:
+            v = lang_map.get(key, ((), ()))
+            plugin_v = plugin_map.get(key, ((), ()))
+            user_v = user_map.get(key, ((), ()))
+            for l in (tuple(user_v[1]) + tuple(plugin_v[1]) + v[1]):
+                if l.startswith('scope:'):
+                    scope = l[6:]  # remove "scope:" prefix
+                    syntax = self.find_syntax_by_scope(scope)
+                else:
+                    syntax = self.find_syntax_file(l)
+                if syntax is not None:
+                    break
+            if syntax is not None:
+                break
+
+        if syntax is None:
+            # Use "source.LANG" and "text.LANG" as fallbacks if possible
+            for scope in ('source.' + lang, 'text.' + lang):
+                syntax = self.find_syntax_by_scope(scope)
+                if syntax is not None:
+                    break
+
+        if syntax is None:
+            # Default to plain text, but don't remember it as the syntax may be provided by a package loaded later.
+            return self.find_syntax_file('Text/Plain text')
+
+        with self.lock:
+            # Only remember the result if the index wasn't invalidated while resolving.
+            if self.user_map is user_map:
+                self.resolved[cache_key] = syntax
+        return syntax
+
+    @staticmethod
+    def find_syntax_file(name):
+        """Find the syntax file for the given `Package/Name` (extension excluded)."""
+
+        for ext in ST_LANGUAGES:
+            syntax_file = 'Packages/{}{}'.format(name, ext)
+            base = os.path.basename(syntax_file)
+            results = set(sublime.find_resources(base))
+            if syntax_file in results:
+                try:
+                    sublime.load_binary_resource(syntax_file)
+                except Exception:
+                    continue
+                return syntax_file
+        return None
+
+    @staticmethod
+    def find_syntax_by_scope(scope):
+        """Find the syntax by the `scope`. Only works in ST 4."""
+
+        if hasattr(sublime, 'find_syntax_by_scope'):
+            syntaxes = sublime.find_syntax_by_scope(scope)
+            if syntaxes:
+                return syntaxes[0].path
+        return None
+
+
+syntax_index = SyntaxIndex()
 
 
 class SublimeHighlight(object):
@@ -47,6 +323,26 @@ class SublimeHighlight(object):
         """Initialization."""
 
         self.view = None
+        self.scheme = scheme
+        self.style = None
+        self.style_key = None
+        # Style lookups per scope, only valid for the style of the scratch view they were made with.
+        self.scope_styles = {}
+        self.scope_defaults = None
+
+    def sync_style(self, view):
+        """
+        Remember the key of the view's effective style, which is part of the key of highlighted fragments.
+
+        With `color_scheme` set to `auto`, the scheme in use follows the OS appearance while the setting,
+        and so this object, stays the same.
+        """
+
+        style = view.style()
+        if style != self.style:
+            self.style_key = hashlib.sha1(repr(sorted(style.items())).encode('utf-8')).hexdigest()
+            self.style = style
+        return self.style_key
 
     def setup(self, **kwargs):
         """Get get general document preferences from sublime preferences."""
@@ -143,45 +439,93 @@ class SublimeHighlight(object):
 
         line.append(code)
 
+    def get_scope_runs(self, start, end):
+        """
+        Get runs of contiguous text that share the same scope.
+
+        Runs are returned as `[begin, end, scope]`. If the API is available, the tokens are extracted
+        for the whole region at once, if not, we fall back to querying the scope of each character.
+        """
+
+        runs = []
+        if start >= end:
+            return runs
+
+        if hasattr(self.view, 'extract_tokens_with_scopes'):
+            covered = 0
+            for region, scope in self.view.extract_tokens_with_scopes(sublime.Region(start, end)):
+                a = max(region.begin(), start)
+                b = min(region.end(), end)
+                if a >= b:
+                    continue
+                if runs and runs[-1][1] == a and runs[-1][2] == scope:
+                    runs[-1][1] = b
+                else:
+                    runs.append([a, b, scope])
+                covered += b - a
+            # Make sure the tokens cover the entire region, if not, walk the characters instead.
+            if covered == end - start and runs[0][0] == start:
+                return runs
+            runs = []
+
+        pt = start
+        while pt < end:
+            scope = self.view.scope_name(pt)
+            nxt = pt + 1
+            while nxt < end and self.view.scope_name(nxt) == scope:
+                nxt += 1
+            runs.append([pt, nxt, scope])
+            pt = nxt
+        return runs
+
+    def get_scope_style(self, scope_name, do_highlight):
+        """Get the color, background color, and font style for the scope (memoized)."""
+
+        key = (scope_name, do_highlight)
+        value = self.scope_styles.get(key)
+        if value is not None:
+            return value
+
+        color_match = self.view.style_for_scope(scope_name)
+        color = color_match.get('foreground', self.fground)
+        bgcolor = color_match.get('background')
+        style = []
+        if color_match.get('bold', False):
+            style.append('bold')
+        if color_match.get('italic', False):
+            style.append('italic')
+        if color_match.get('underline', False):
+            style.append('underline')
+        if color_match.get('glow', False):
+            style.append('glow')
+
+        if do_highlight:
+            sfg = color_match.get('selection_forground', self.defaults.get('selection_forground'))
+            if sfg:
+                color = sfg
+            bgcolor = color_match.get('selection', '#0000FF')
+
+        value = (color, bgcolor, style)
+        self.scope_styles[key] = value
+        return value
+
     def convert_line_to_html(self, empty):
         """Convert the line to its HTML representation."""
 
         line = []
         do_highlight = self.curr_row in self.hl_lines
 
-        while self.end <= self.size:
-            # Get text of like scope
-            scope_name = self.view.scope_name(self.pt)
-            while self.view.scope_name(self.end) == scope_name and self.end < self.size:
-                self.end += 1
-
-            color_match = self.view.style_for_scope(scope_name)
-            color = color_match.get('foreground', self.fground)
-            bgcolor = color_match.get('background')
-            style = []
-            if color_match.get('bold', False):
-                style.append('bold')
-            if color_match.get('italic', False):
-                style.append('italic')
-            if color_match.get('underline', False):
-                style.append('underline')
-            if color_match.get('glow', False):
-                style.append('glow')
-
-            if do_highlight:
-                sfg = color_match.get('selection_forground', self.defaults.get('selection_forground'))
-                if sfg:
-                    color = sfg
-                bgcolor = color_match.get('selection', '#0000FF')
-
-            region = sublime.Region(self.pt, self.end)
+        # Emit a span for each run of text of like scope
+        for start, end, scope_name in self.get_scope_runs(self.pt, self.size):
+            color, bgcolor, style = self.get_scope_style(scope_name, do_highlight)
+            region = sublime.Region(start, end)
             # Normal text formatting
             tidied_text = self.html_encode(self.view.substr(region))
             self.format_text(line, tidied_text, color, bgcolor, style, empty)
 
-            # Continue walking through line
-            self.pt = self.end
-            self.end = self.pt + 1
+        # Continue walking through the next line
+        self.pt = max(self.pt, self.size)
+        self.end = self.pt + 1
 
         # ```
         # # Get the color for the space at the end of a line
@@ -217,82 +561,42 @@ class SublimeHighlight(object):
         if plugin_map is None:
             plugin_map = {}
 
-        # Get the output panel
-        self.view = sublime.active_window().create_output_panel('mdpopups', unlisted=True)
-        # Let all plugins no to leave this view alone
-        self.view.settings().set('is_widget', True)
-        # Don't translate anything.
-        self.view.settings().set("translate_tabs_to_spaces", False)
-        # Don't mess with my indenting Sublime!
-        self.view.settings().set("auto_indent", False)
-        # Insert into the view
-        self.view.run_command('insert', {'characters': src})
-        # Setup the proper syntax
-        lang = lang.lower()
-        user_map = sublime.load_settings('Preferences.sublime-settings').get('mdpopups.sublime_user_lang_map', {})
-        keys = set(user_map.keys()) | (set(plugin_map.keys()) | set(lang_map.keys()))
-        loaded = False
-        for key in keys:
-            v = lang_map.get(key, ((), ()))
-            plugin_v = plugin_map.get(key, ((), ()))
-            user_v = user_map.get(key, ((), ()))
-            if lang in (tuple(user_v[0]) + plugin_v[0] + v[0]):
-                for l in (tuple(user_v[1]) + plugin_v[1] + v[1]):
-                    if l.startswith('scope:'):
-                        scope = l[6:]  # remove "scope:" prefix
-                        if self.set_syntax_by_scope(scope):
-                            loaded = True
-                            break
-                        continue
-
-                    for ext in ST_LANGUAGES:
-                        syntax_file = 'Packages/{}{}'.format(l, ext)
-                        base = os.path.basename(syntax_file)
-                        results = set(sublime.find_resources(base))
-                        if syntax_file in results:
-                            try:
-                                sublime.load_binary_resource(syntax_file)
-                            except Exception:
-                                continue
-                        else:
-                            continue
-                        self.view.assign_syntax(syntax_file)
-                        loaded = True
-                        break
-                    if loaded:
-                        break
-            if loaded:
-                break
-        if not loaded:
-            # Use "source.LANG" and "text.LANG" as fallbacks if possible
-            for scope in ('source.' + lang, 'text.' + lang):
-                if self.set_syntax_by_scope(scope):
-                    loaded = True
-                    break
-        if not loaded:
-            # Default to plain text
-            for ext in ST_LANGUAGES:
-                # Just in case text one day switches to 'sublime-syntax'
-                syntax_file = 'Packages/Text/Plain text{}'.format(ext)
-                base = os.path.basename(syntax_file)
-                results = set(sublime.find_resources(base))
-                if syntax_file in results:
-                    try:
-                        sublime.load_binary_resource(syntax_file)
-                    except Exception:
-                        continue
-                else:
-                    continue
-                self.view.assign_syntax(syntax_file)
+        # Get a view that is already set up with the proper syntax and replace its content
+        syntax = syntax_index.resolve(lang.lower(), plugin_map)
+        self.view = scratch_views.acquire(sublime.active_window(), syntax)
+        scratch_views.fill(self.view, src)
 
     def syntax_highlight(self, src, lang, hl_lines=None, inline=False, no_wrap=False, code_wrap=False, plugin_map=None):
         """Syntax Highlight."""
 
         if hl_lines is None:
             hl_lines = []
+        if plugin_map is None:
+            plugin_map = {}
+
+        src = RE_TAIL.sub('', src)
+        lang = 'text' if not lang else lang
+        key = (
+            'sublime', self.scheme, self.style_key, syntax_index.resolve(lang.lower(), plugin_map), src,
+            tuple(hl_lines), inline, no_wrap, code_wrap
+        )
+        code = fragment_cache.get(key)
+        if code is None:
+            # Highlighting stores state on the object and fills a shared view, so it is only done on the UI thread.
+            code = run_on_ui_thread(
+                self._syntax_highlight, src, lang, hl_lines, inline, no_wrap, code_wrap, plugin_map
+            )
+            fragment_cache.set(key, code)
+        return code
 
-        self.set_view(RE_TAIL.sub('', src), 'text' if not lang else lang, plugin_map)
+    def _syntax_highlight(self, src, lang, hl_lines, inline, no_wrap, code_wrap, plugin_map):
+        """Syntax Highlight."""
+
+        self.set_view(src, lang, plugin_map)
         self.defaults = self.view.style()
+        if self.defaults != self.scope_defaults:
+            self.scope_styles = {}
+            self.scope_defaults = self.defaults
         self.fground = self.defaults.get('foreground', '#000000')
         self.bground = self.defaults.get('background', '#FFFFFF')
         self.inline = inline
@@ -303,12 +607,3 @@ class SublimeHighlight(object):
         self.html = []
         self.write_body()
         return ''.join(self.html)
-
-    def set_syntax_by_scope(self, scope):
-        """Set syntax by the `scope`. Only works in ST 4."""
-        if hasattr(sublime, 'find_syntax_by_scope'):
-            syntaxes = sublime.find_syntax_by_scope(scope)
-            if syntaxes:
-                self.view.assign_syntax(syntaxes[0])
-                return True
-        return False
@@ -5,6 +5,7 @@ Licensed under MIT
 Copyright (c) 2015 - 2020 Isaac Muse <isaacmuse@gmail.com>
 """
 import re
+from .cache import fragment_cache
 from .pygments import highlight
 from .pygments.lexers import get_lexer_by_name, guess_lexer
 from .pygments.formatters import find_formatter_class
@@ -166,6 +167,17 @@ class SublimeInlineHtmlFormatter(HtmlFormatter):
 def syntax_hl(src, lang=None, guess_lang=False, inline=False, code_wrap=False):
     """Highlight."""
 
+    key = ('pygments-simple', src, lang, guess_lang, inline, code_wrap)
+    code = fragment_cache.get(key)
+    if code is None:
+        code = _syntax_hl(src, lang, guess_lang, inline, code_wrap)
+        fragment_cache.set(key, code)
+    return code
+
+
+def _syntax_hl(src, lang=None, guess_lang=False, inline=False, code_wrap=False):
+    """Highlight."""
+
     css_class = 'highlight'
 
     src = src.strip('\n')
@@ -21,8 +21,12 @@ from .coloraide.css.parse import norm_angle_channel
 from .st_colormod import Color
 from . import jinja2
 from .pygments.formatters import HtmlFormatter
+from .pygments import __version__ as pygments_version
 from collections import OrderedDict
 from .st_clean_css import clean_css
+from .cache import LRUCache, DiskCache
+import hashlib
+import threading
 import copy
 import os
 
@@ -34,6 +38,10 @@ POPUP = 0
 PHANTOM = 1
 SHEET = 2
 LUM_MIDPOINT = 127
+TEMPLATE_CACHE_LIMIT = 20
+STYLE_CACHE_LIMIT = 50
+CSS_DISK_CACHE_BUDGET = 5 * 1024 * 1024
+TEMPLATE_BYTECODE_BUDGET = 5 * 1024 * 1024
 
 re_float_trim = re.compile(r'^(?P<keep>\d+)(?P<trash>\.0+|(?P<keep2>\.\d*[1-9])0+)$')
 re_valid_custom_scopes = re.compile(r'[a-zA-Z\d]+[a-zA-Z\d._\-]*')
@@ -48,6 +56,113 @@ CODE_BLOCKS = '.mdpopups .highlight, .mdpopups .inline-highlight {{ {}; {}; }}'
 OLD_DEFAULT_CSS = 'Packages/mdpopups/css/default.css'
 DEFAULT_CSS = 'Packages/mdpopups/mdpopups_css/default.css'
 
+_css_disk_cache = None
+_template_bytecode_cache = None
+_pygments_css = {}
+
+
+class TemplateBytecodeCache(jinja2.BytecodeCache):
+    """
+    Compiled Jinja2 templates stored on disk.
+
+    Entries are kept in a size bounded `DiskCache`, which writes atomically,
+    so the cache can be shared by multiple plugin hosts. The bytecode records
+    the Jinja2 and Python versions and the checksum of the source, so outdated
+    entries are simply compiled again.
+    """
+
+    def __init__(self, path, budget=TEMPLATE_BYTECODE_BUDGET):
+        """Initialize."""
+
+        self.disk = DiskCache(path, budget)
+
+    def load_bytecode(self, bucket):
+        """Load the bytecode of the bucket from disk."""
+
+        data = self.disk.get(bucket.key)
+        if data is not None:
+            try:
+                bucket.bytecode_from_string(data)
+            except Exception:
+                bucket.reset()
+
+    def dump_bytecode(self, bucket):
+        """Store the bytecode of the bucket on disk."""
+
+        self.disk.set(bucket.key, bucket.bytecode_to_string())
+
+    def clear(self):
+        """Clear the cache."""
+
+        self.disk.clear()
+
+    def stats(self):
+        """Return cache statistics."""
+
+        return self.disk.stats()
+
+
+def get_template_bytecode_cache():
+    """Get the on disk cache of compiled templates."""
+
+    global _template_bytecode_cache
+
+    if _template_bytecode_cache is None:
+        _template_bytecode_cache = TemplateBytecodeCache(
+            os.path.join(sublime.cache_path(), 'mdpopups', 'templates'), TEMPLATE_BYTECODE_BUDGET
+        )
+    return _template_bytecode_cache
+
+
+def template_from_string(env, source, namespace=''):
+    """
+    Compile a template like `Environment.from_string`, but load and store the compiled code on disk.
+
+    `namespace` must identify the options of the environment, as they change the compiled code.
+    """
+
+    bcc = get_template_bytecode_cache()
+    name = repr((namespace, ver.version(), jinja2.__version__, bcc.get_source_checksum(source)))
+    bucket = bcc.get_bucket(env, name, None, source)
+    if bucket.code is None:
+        bucket.code = env.compile(source)
+        bcc.set_bucket(bucket)
+    return env.template_class.from_code(env, bucket.code, env.make_globals(None), None)
+
+
+def scheme_filter(func):
+    """
+    Wrap a filter that depends on the scheme, so it is always called when rendering.
+
+    Jinja2 calls filters with constant arguments while compiling and stores the result in the
+    compiled code, which is shared by all schemes and stored on disk. Filters that take the
+    context are never called while compiling.
+    """
+
+    @jinja2.pass_context
+    def wrapper(context, *args, **kwargs):
+        """Call the filter without the context."""
+
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def get_css_disk_cache():
+    """Get the on disk cache of rendered stylesheets."""
+
+    global _css_disk_cache
+
+    if _css_disk_cache is None:
+        _css_disk_cache = DiskCache(os.path.join(sublime.cache_path(), 'mdpopups', 'css'), CSS_DISK_CACHE_BUDGET)
+    return _css_disk_cache
+
+
+def clear_css_cache():
+    """Clear the Pygments CSS stored in memory."""
+
+    _pygments_css.clear()
+
+
 re_css_filter = re.compile(
     r'''(?xi)[\t ]*(?:
         (brightness|contrast|grayscale|invert|opacity|satruate|sepia|protan|deutan|tritan)
@@ -248,13 +363,54 @@ class SchemeTemplate(object):
         self.css_type = INVALID
         self.variable = {}
         self.view = None
+        # Rendering stores state on the object, so only one thread may render at a time.
+        self.lock = threading.RLock()
         self.setup()
 
+    def sync_style(self, view):
+        """
+        Get the key of the view's effective style, forgetting memoized styles if it changed.
+
+        With `color_scheme` set to `auto`, the scheme in use follows the OS appearance while the setting,
+        and so this object, stays the same. The memoized styles are only valid for the effective style.
+        """
+
+        style = view.style()
+        if style != self.style:
+            self.style_key = hashlib.sha1(repr(sorted(style.items())).encode('utf-8')).hexdigest()
+            self.scope_styles = {}
+            self.style = style
+        return self.style_key
+
+    def get_style(self, view):
+        """Get the general scheme style (memoized)."""
+
+        if self.style is None:
+            self.sync_style(view)
+        return self.style
+
+    def get_scope_style(self, view, scope):
+        """Get the style for a scope (memoized)."""
+
+        style = self.scope_styles.get(scope)
+        if style is None:
+            style = view.style_for_scope(scope)
+            self.scope_styles[scope] = style
+        return style
+
+    def prefetch_scopes(self, view, scopes):
+        """Resolve and memoize the styles of multiple scopes at once."""
+
+        self.sync_style(view)
+        for scope in scopes:
+            self.get_scope_style(view, scope.lstrip('.'))
+
     def guess_style(self, view, scope, selected=False, explicit_background=False):
         """Guess color."""
 
+        self.sync_style(view)
         # Remove leading '.' to account for old style CSS
-        scope_style = view.style_for_scope(scope.lstrip('.'))
+        scope_style = self.get_scope_style(view, scope.lstrip('.'))
         style = {}
         style['foreground'] = scope_style['foreground']
         style['background'] = scope_style.get('background')
@@ -263,7 +419,7 @@ class SchemeTemplate(object):
         style['underline'] = scope_style.get('underline', False)
         style['glow'] = scope_style.get('glow', False)
 
-        defaults = view.style()
+        defaults = self.get_style(view)
         if not explicit_background and not style.get('background'):
             style['background'] = defaults.get('background', '#FFFFFF')
         if selected:
@@ -307,12 +463,12 @@ class SchemeTemplate(object):
     def get_fg(self):
         """Get foreground."""
 
-        return self.view.style().get('foreground', '#000000')
+        return self.get_style(self.view).get('foreground', '#000000')
 
     def get_bg(self):
         """Get background."""
 
-        return self.view.style().get('background', '#FFFFFF')
+        return self.get_style(self.view).get('background', '#FFFFFF')
 
     def setup(self):
         """Setup the template environment."""
@@ -321,9 +477,21 @@ class SchemeTemplate(object):
         self.use_pygments = not settings.get('mdpopups.use_sublime_highlighter', True)
         self.default_style = settings.get('mdpopups.default_style', True)
 
+        # Scope styles only change with the effective scheme, see `sync_style`.
+        self.style = None
+        self.style_key = None
+        self.scope_styles = {}
+        # The hash of the scheme content is only computed once the disk cache is consulted.
+        self.disk_key = None
+
+        # Compiled templates keyed by CSS source and rendered CSS keyed by all render inputs.
+        # Both are only valid for this scheme, so they live and die with the object.
+        self.template_cache = LRUCache(TEMPLATE_CACHE_LIMIT)
+        self.style_cache = LRUCache(STYLE_CACHE_LIMIT)
+
         # Create Jinja template
         self.env = jinja2.Environment()
-        self.env.filters['css'] = self.retrieve_selector
+        self.env.filters['css'] = scheme_filter(self.retrieve_selector)
         self.env.filters['pygments'] = self.pygments
         self.env.filters['foreground'] = self.to_fg
         self.env.filters['background'] = self.to_bg
@@ -336,8 +504,42 @@ class SchemeTemplate(object):
         self.env.filters['grayscale'] = self.grayscale
         self.env.filters['sepia'] = self.sepia
         self.env.filters['filters'] = self.filters
-        self.env.filters['fade'] = self.fade
-        self.env.filters['getcss'] = self.read_css
+        self.env.filters['fade'] = scheme_filter(self.fade)
+        self.env.filters['getcss'] = scheme_filter(self.read_css)
+
+    def get_disk_key(self):
+        """
+        Get a key that identifies everything the rendered CSS of this scheme depends on.
+
+        This includes the content of the scheme and any overrides of it, so edits to the scheme are not missed.
+        If the scheme is `auto`, both the light and dark scheme are included. Hashing the content is memoized,
+        but the view's effective style, which tells which of the two is in use, is added on each lookup.
+        """
+
+        if self.disk_key is None:
+            schemes = [self.scheme_file]
+            if self.scheme_file == 'auto':
+                settings = self.view.settings()
+                schemes.extend(settings.get(name) or '' for name in ('light_color_scheme', 'dark_color_scheme'))
+
+            digest = hashlib.sha1()
+            for scheme in schemes:
+                digest.update(scheme.encode('utf-8'))
+                for resource in sorted(sublime.find_resources(os.path.basename(scheme))) if scheme else []:
+                    try:
+                        content = sublime.load_binary_resource(resource)
+                    except Exception:
+                        continue
+                    digest.update(resource.encode('utf-8'))
+                    digest.update(content)
+
+            self.disk_key = repr(
+                (
+                    self.scheme_file, digest.hexdigest(), ver.version(), sublime.version(), pygments_version,
+                    self.use_pygments, self.default_style
+                )
+            )
+        return self.disk_key + self.style_key
 
     def read_css(self, css):
         """Read the CSS file."""
@@ -363,14 +565,24 @@ class SchemeTemplate(object):
                 except Exception:
                     pass
 
-                return self.env.from_string(css).render(var=var, plugin=self.plugin_vars)
+                return self.get_template(css).render(var=var, plugin=self.plugin_vars)
 
-            return self.env.from_string(
+            return self.get_template(
                 clean_css(sublime.load_resource(css))
             ).render(var=var, plugin=self.plugin_vars)
         except Exception:
             return ''
 
+    def get_template(self, css):
+        """Get the compiled template for the CSS source."""
+
+        key = hashlib.sha1(css.encode('utf-8')).hexdigest()
+        template = self.template_cache.get(key)
+        if template is None:
+            template = template_from_string(self.env, css, 'scheme:runtime')
+            self.template_cache.set(key, template)
+        return template
+
     def filters(self, css, string, space='srgb'):
         """Apply CSS filters."""
 
@@ -518,10 +730,10 @@ class SchemeTemplate(object):
     def retrieve_selector(self, selector, key=None, explicit_background=True):
         """Get the CSS key, value pairs for a rule."""
 
-        general = self.view.style()
+        general = self.get_style(self.view)
         fg = general.get('foreground', '#000000')
         bg = general.get('background', '#ffffff')
-        scope = self.view.style_for_scope(selector)
+        scope = self.get_scope_style(self.view, selector)
         style = []
         if scope.get('bold', False):
             style.append('bold')
@@ -556,11 +768,23 @@ class SchemeTemplate(object):
     def apply_template(self, view, css, css_type, template_vars=None):
         """Apply template to CSS."""
 
-        self.view = view
-
         if css_type not in (POPUP, PHANTOM, SHEET):
             return ''
 
+        with self.lock:
+            self.view = view
+            self.sync_style(view)
+            return self._apply_template(css, css_type, template_vars)
+
+    def _apply_template(self, css, css_type, template_vars):
+        """Apply template to CSS."""
+
+        # Output is deterministic for a given effective scheme style, so reuse previously rendered CSS.
+        key = hashlib.sha1(repr((self.style_key, css, css_type, template_vars)).encode('utf-8')).hexdigest()
+        style = self.style_cache.get(key)
+        if style is not None:
+            return style
+
         self.css_type = css_type
         self.variables = self.get_variables()
 
@@ -578,7 +802,22 @@ class SchemeTemplate(object):
             }
         )
 
-        return self.env.from_string(css).render(var=var, plugin=self.plugin_vars)
+        # Stylesheets without plugin variables are the same every time, so they are also persisted to disk.
+        # Resources included with `getcss` are not part of the key, so stylesheets that use it are not persisted.
+        persist = not self.plugin_vars and 'getcss' not in css
+        if persist:
+            disk_key = self.get_disk_key() + key
+            data = get_css_disk_cache().get(disk_key)
+            if data is not None:
+                style = data.decode('utf-8')
+                self.style_cache.set(key, style)
+                return style
+
+        style = self.get_template(css).render(var=var, plugin=self.plugin_vars)
+        self.style_cache.set(key, style)
+        if persist:
+            get_css_disk_cache().set(disk_key, style.encode('utf-8'))
+        return style
 
 
 def get_pygments(style):
@@ -595,6 +834,22 @@ def get_pygments(style):
     respectively.
     """
 
+    css = _pygments_css.get(style)
+    if css is None:
+        key = repr(('pygments', style, pygments_version, ver.version()))
+        data = get_css_disk_cache().get(key)
+        if data is not None:
+            css = data.decode('utf-8')
+        else:
+            css = _get_pygments(style)
+            get_css_disk_cache().set(key, css.encode('utf-8'))
+        _pygments_css[style] = css
+    return css
+
+
+def _get_pygments(style):
+    """Generate the Pygments style CSS."""
+
     try:
         # Lets see if we can find the Pygments theme
         text = HtmlFormatter(style=style).get_style_defs('.dummy')
@@ -1,6 +1,6 @@
 """Version."""
 
-_version_info = (5, 1, 3)
+_version_info = (5, 2, 0)
 __version__ = '.'.join([str(x) for x in _version_info])
 
 
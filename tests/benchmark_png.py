@@ -0,0 +1,63 @@
+"""
+Benchmark PNG encoding.
+
+Compares the generic row based `Writer.write` with the `Writer.write_buffer` fast path
+for the small images MdPopups generates. Run with `python -m tests.benchmark_png`.
+"""
+import functools
+import io
+import timeit
+from .util import import_module
+
+png = import_module('png')
+
+SIZES = ((16, 16), (32, 32), (64, 64))
+NUMBER = 200
+
+
+def make_image(width, height, planes):
+    """Create a packed 8 bit image."""
+
+    return bytes((x * 7 + y * 13 + p * 31) % 256 for y in range(height) for x in range(width) for p in range(planes))
+
+
+def encode_rows(width, height, planes, data, compression):
+    """Encode with the generic writer."""
+
+    stride = width * planes
+    rows = [list(data[i:i + stride]) for i in range(0, len(data), stride)]
+    with io.BytesIO() as f:
+        png.Writer(width, height, alpha=planes == 4, compression=compression).write(f, rows)
+        return f.getvalue()
+
+
+def encode_buffer(width, height, planes, data, compression):
+    """Encode with the fast path."""
+
+    with io.BytesIO() as f:
+        png.Writer(width, height, alpha=planes == 4, compression=compression).write_buffer(f, data)
+        return f.getvalue()
+
+
+def main():
+    """Run the benchmark."""
+
+    print('{:<10} {:<6} {:>10} {:>10} {:>10} {:>8}'.format('size', 'mode', 'write', 'buffer', 'buffer(1)', 'speedup'))
+    for width, height in SIZES:
+        for planes in (3, 4):
+            data = make_image(width, height, planes)
+            times = [
+                timeit.timeit(
+                    functools.partial(encode, width, height, planes, data, level), number=NUMBER
+                ) / NUMBER * 1e6
+                for encode, level in ((encode_rows, None), (encode_buffer, None), (encode_buffer, 1))
+            ]
+            print(
+                '{:<10} {:<6} {:>8.1f}us {:>8.1f}us {:>8.1f}us {:>7.1f}x'.format(
+                    '{}x{}'.format(width, height), 'RGBA' if planes == 4 else 'RGB', *times, times[0] / times[2]
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
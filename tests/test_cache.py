@@ -0,0 +1,42 @@
+"""Test the cache utilities."""
+import time
+import unittest
+from .util import import_module
+
+cache = import_module('cache')
+
+
+class TestLRUCache(unittest.TestCase):
+    """Test the least recently used cache."""
+
+    def test_lru(self):
+        """Test the least recently used entry is evicted."""
+
+        lru = cache.LRUCache(2, sizeof=len)
+        lru.set('a', 'aaa')
+        lru.set('b', 'bb')
+        self.assertEqual(lru.get('a'), 'aaa')
+        lru.set('c', 'c')
+        self.assertNotIn('b', lru)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(
+            lru.stats(),
+            {'hits': 1, 'misses': 1, 'evictions': 1, 'size': 2, 'limit': 2, 'memory': 4}
+        )
+        lru.resize(1)
+        self.assertEqual(list(lru._entries), ['c'])
+        self.assertEqual(lru.memory, 1)
+
+    def test_ttl(self):
+        """Test expired entries are removed when looked up."""
+
+        lru = cache.LRUCache(2, ttl=0.1)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), 1)
+        time.sleep(0.15)
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(len(lru), 0)
+        self.assertEqual(lru.stats()['expirations'], 1)
+        lru.resize(2, 0)
+        lru.set('b', 2)
+        self.assertIsNone(lru.get('b'))
@@ -0,0 +1,155 @@
+"""Test color boxes."""
+import unittest
+from .util import import_module
+
+colorbox = import_module('colorbox')
+Color = import_module('coloraide').Color
+png = import_module('png')
+
+MAX = colorbox.MAX_VALUE
+BLACK = (0, 0, 0)
+RED = (MAX, 0, 0)
+GREEN = (0, MAX, 0)
+BLUE = (0, 0, MAX)
+WHITE = (MAX, MAX, MAX)
+GREY = (0xCC * 257,) * 3
+
+
+def box(colors, border='#000000', border2=None, **kwargs):
+    """Render a color box from color strings, like the public API."""
+
+    return colorbox.color_box_raw(
+        [Color(c) for c in colors], Color(border), Color(border2) if border2 is not None else None, **kwargs
+    )
+
+
+def decode(data):
+    """Decode a color box to rows of pixels."""
+
+    width, height, rows, meta = png.Reader(bytes=data).read()
+    planes = meta['planes']
+    pixels = [
+        [tuple(row[x:x + planes]) for x in range(0, width * planes, planes)]
+        for row in rows
+    ]
+    return width, height, pixels, meta
+
+
+def ring(pixels, index):
+    """Get the pixels of a ring that is `index` pixels from the edge."""
+
+    rows = pixels[index:len(pixels) - index]
+    return (
+        rows[0][index:len(rows[0]) - index] + rows[-1][index:len(rows[-1]) - index] +
+        [row[index] for row in rows] + [row[-1 - index] for row in rows]
+    )
+
+
+def inside(pixels, index):
+    """Get the pixels inside of `index` rings."""
+
+    return [p for row in pixels[index:len(pixels) - index] for p in row[index:len(row) - index]]
+
+
+class TestColorBox(unittest.TestCase):
+    """Test color boxes."""
+
+    def setUp(self):
+        """Start with an empty cache."""
+
+        colorbox.box_cache.clear()
+
+    def test_border(self):
+        """Test a single border around a color."""
+
+        width, height, pixels, meta = decode(
+            box(['#ff0000'], height=8, width=10)
+        )
+        self.assertEqual((width, height), (10, 8))
+        self.assertEqual((meta['bitdepth'], meta['planes']), (16, 3))
+        self.assertEqual(set(ring(pixels, 0)), {BLACK})
+        self.assertEqual(set(inside(pixels, 1)), {RED})
+
+    def test_border2(self):
+        """Test a double border."""
+
+        pixels = decode(
+            box(['#ff0000'], '#000000', '#00ff00', height=12, width=12, border_size=4)
+        )[2]
+        self.assertEqual(set(ring(pixels, 0)) | set(ring(pixels, 1)), {BLACK})
+        self.assertEqual(set(ring(pixels, 2)) | set(ring(pixels, 3)), {GREEN})
+        self.assertEqual(set(inside(pixels, 4)), {RED})
+
+    def test_border_map(self):
+        """Test borders on only some of the sides."""
+
+        pixels = decode(
+            box(['#0000ff'], height=6, width=6, border_map=colorbox.TOP | colorbox.LEFT)
+        )[2]
+        self.assertEqual(set(pixels[0]), {BLACK})
+        self.assertEqual({row[0] for row in pixels}, {BLACK})
+        self.assertEqual({p for row in pixels[1:] for p in row[1:]}, {BLUE})
+
+    def test_dividers(self):
+        """Test multiple colors are laid out from left to right."""
+
+        pixels = decode(
+            box(['#ff0000', '#00ff00', '#0000ff', '#ffffff'], height=5, width=11, max_colors=3)
+        )[2]
+        for row in pixels[1:-1]:
+            self.assertEqual(row[1:-1], [RED] * 3 + [GREEN] * 3 + [BLUE] * 3)
+
+    def test_checkerboard(self):
+        """Test transparent colors show the checkerboard when there is no alpha channel."""
+
+        pixels = decode(
+            box(['#ff000080'], height=10, width=10, check_size=2)
+        )[2]
+        light = tuple(colorbox.to_list(colorbox.checkered_color(Color('#ff000080'), colorbox.CHECK_LIGHT)))
+        dark = tuple(colorbox.to_list(colorbox.checkered_color(Color('#ff000080'), colorbox.CHECK_DARK)))
+        self.assertNotEqual(light, dark)
+        for y, row in enumerate(pixels[1:-1]):
+            for x, pixel in enumerate(row[1:-1]):
+                self.assertEqual(pixel, dark if (x // 2 + y // 2) % 2 == 0 else light)
+
+    def test_empty(self):
+        """Test no colors shows the bare checkerboard."""
+
+        pixels = decode(box([], height=6, width=6, check_size=2))[2]
+        self.assertEqual(set(ring(pixels, 0)), {BLACK})
+        self.assertEqual(pixels[1][1:-1], [GREY, GREY, WHITE, WHITE])
+        self.assertEqual(pixels[3][1:-1], [WHITE, WHITE, GREY, GREY])
+
+    def test_alpha(self):
+        """Test an alpha channel with borders, which are opaque."""
+
+        width, height, pixels, meta = decode(
+            box(['#ff000080'], '#000000', '#00ff00', height=8, width=8, border_size=2, alpha=True)
+        )
+        self.assertEqual((width, height), (8, 8))
+        self.assertEqual(meta['planes'], 4)
+        self.assertEqual(set(ring(pixels, 0)), {BLACK + (MAX,)})
+        self.assertEqual(set(ring(pixels, 1)), {GREEN + (MAX,)})
+        self.assertEqual(set(inside(pixels, 2)), {RED + (0x80 * 257,)})
+
+    def test_alpha_empty(self):
+        """Test an alpha channel with no colors is transparent."""
+
+        pixels = decode(box([], height=6, width=6, alpha=True))[2]
+        self.assertEqual(set(ring(pixels, 0)), {BLACK + (MAX,)})
+        self.assertEqual({p[3] for p in inside(pixels, 1)}, {0})
+
+    def test_batch(self):
+        """Test a batch gives the same color boxes as rendering them one at a time."""
+
+        color_sets = [['#ff0000'], ['#00ff00', '#0000ff'], [], ['#ff0000']]
+        batch = colorbox.color_box_raw_batch(
+            [[Color(c) for c in colors] for colors in color_sets], Color('#000000'), alpha=True
+        )
+        self.assertEqual(colorbox.box_cache.stats()['size'], 3)
+        colorbox.box_cache.clear()
+        self.assertEqual(batch, [box(colors, alpha=True) for colors in color_sets])
+        self.assertEqual(
+            decode(batch[1])[2][5][1:31],
+            [(0, MAX, 0, MAX)] * 15 + [(0, 0, MAX, MAX)] * 15
+        )
@@ -0,0 +1,47 @@
+"""Test frontmatter loading."""
+import unittest
+from collections import OrderedDict
+from .util import import_module
+
+frontmatter = import_module('frontmatter')
+
+
+class TestFrontmatter(unittest.TestCase):
+    """Test frontmatter loading."""
+
+    def test_fast_loader(self):
+        """Test the fast loader loads dumped frontmatter the same as the full loader."""
+
+        values = OrderedDict([
+            ('allow_code_wrap', True),
+            ('markdown_extensions', [
+                'markdown.extensions.admonition',
+                {'pymdownx.superfences': {'custom_fences': [{'name': 'math', 'class': 'arithmatex'}]}},
+                {'pymdownx.magiclink': None},
+                [1, [2.5, None]],
+                []
+            ]),
+            ('language_map', {'js': [['javascript'], ['JavaScript']]}),
+            ('strings', ['yes', '', 'x: y', "it's", '1:30', 'héllo']),
+            (1, {})
+        ])
+        yaml = frontmatter.dump_frontmatter(values)[4:-5]
+        self.assertEqual(frontmatter.fast_yaml_load(yaml), frontmatter.yaml_load(yaml))
+
+        exotic = ('a: &x 1\nb: *x\n', 'a: |\n    text\n', 'a: {b: c}\n', 'a: b\n    c\n', 'a: "\\t"\n', 'a: b # c\n')
+        for yaml in exotic:
+            with self.assertRaises(frontmatter.UnsupportedYaml):
+                frontmatter.fast_yaml_load(yaml)
+
+    def test_cache(self):
+        """Test cached frontmatter is copied, and invalid frontmatter is left in the content."""
+
+        content = frontmatter.dump_frontmatter({'a': [{'b': 1}]}) + 'content'
+        fm, markup = frontmatter.get_frontmatter(content)
+        self.assertEqual((fm, markup), ({'a': [{'b': 1}]}, 'content'))
+        fm['a'][0]['b'] = 2
+        self.assertEqual(frontmatter.get_frontmatter(content)[0], {'a': [{'b': 1}]})
+
+        content = '---\n- a\n---\ncontent'
+        self.assertEqual(frontmatter.get_frontmatter(content), (OrderedDict(), content))
+        self.assertEqual(frontmatter.get_frontmatter(content), (OrderedDict(), content))
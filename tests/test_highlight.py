@@ -0,0 +1,220 @@
+"""Test the Sublime highlighter."""
+import sys
+import threading
+import types
+import unittest
+from unittest import mock
+from .util import import_module
+
+
+class Region(object):
+    """Region."""
+
+    def __init__(self, a, b):
+        """Initialize."""
+
+        self.a = a
+        self.b = b
+
+    def begin(self):
+        """Get the beginning of the region."""
+
+        return min(self.a, self.b)
+
+    def end(self):
+        """Get the end of the region."""
+
+        return max(self.a, self.b)
+
+
+class Selection(list):
+    """Selection."""
+
+    def add(self, region):
+        """Add a region."""
+
+        self.append(region)
+
+
+class View(object):
+    """Output panel that implements the commands used to replace its content."""
+
+    def __init__(self):
+        """Initialize."""
+
+        self.text = ''
+        self.selection = Selection()
+        self.commands = []
+
+    def is_valid(self):
+        """Check if the view is valid."""
+
+        return True
+
+    def settings(self):
+        """Get the view settings."""
+
+        return mock.Mock()
+
+    def assign_syntax(self, syntax):
+        """Assign the syntax."""
+
+    def size(self):
+        """Get the size of the view."""
+
+        return len(self.text)
+
+    def sel(self):
+        """Get the selection."""
+
+        return self.selection
+
+    def run_command(self, name, args=None):
+        """Run a command on each selection, like Sublime Text."""
+
+        self.commands.append(name)
+        for region in self.selection:
+            if name == 'insert' and args['characters']:
+                self.text = self.text[:region.begin()] + args['characters'] + self.text[region.end():]
+            elif name == 'right_delete' and region.begin() != region.end():
+                self.text = self.text[:region.begin()] + self.text[region.end():]
+
+
+class Settings(dict):
+    """Settings."""
+
+    listeners = set()
+
+    def add_on_change(self, key, callback):
+        """Add a change listener."""
+
+        self.listeners.add(key)
+
+    def clear_on_change(self, key):
+        """Remove a change listener."""
+
+        self.listeners.discard(key)
+
+
+class Window(object):
+    """Window."""
+
+    def __init__(self):
+        """Initialize."""
+
+        self.panels = {}
+
+    def id(self):
+        """Get the window ID."""
+
+        return 1
+
+    def create_output_panel(self, name, unlisted=False):
+        """Create an output panel."""
+
+        self.panels[name] = View()
+        return self.panels[name]
+
+
+class TestSublimeHighlight(unittest.TestCase):
+    """Test the Sublime highlighter."""
+
+    def setUp(self):
+        """Import the highlighter with a minimal Sublime Text API."""
+
+        self.window = Window()
+        self.syntaxes = {}
+        self.scheduled = []
+        Settings.listeners = set()
+        sublime = types.ModuleType('sublime')
+        sublime.Region = Region
+        sublime.active_window = lambda: self.window
+        sublime.load_settings = lambda name: Settings()
+        sublime.find_resources = lambda name: ['Packages/Text/Plain text.tmLanguage']
+        sublime.load_binary_resource = lambda name: b''
+        sublime.find_syntax_by_scope = lambda scope: self.syntaxes.get(scope, [])
+        sublime.set_timeout = lambda func, delay=0: self.scheduled.append(func)
+        with mock.patch.dict(sys.modules, {'sublime': sublime}):
+            self.highlight = import_module('st_code_highlight')
+
+    def test_replace(self):
+        """Test content is replaced, including by empty source after a non-empty one."""
+
+        highlighter = self.highlight.SublimeHighlight('scheme')
+        for src in ('first\nsnippet', 'x', '', 'last'):
+            highlighter.set_view(src, 'text', None)
+            self.assertEqual(highlighter.view.text, src)
+            self.assertEqual(len(highlighter.view.commands), 1)
+            highlighter.view.commands.clear()
+
+    def test_shared(self):
+        """Test the highlighters of different schemes share the pooled view."""
+
+        first = self.highlight.SublimeHighlight('first')
+        second = self.highlight.SublimeHighlight('second')
+        first.set_view('a', 'text', None)
+        second.set_view('b', 'text', None)
+        self.assertIs(first.view, second.view)
+        self.assertEqual(len(self.window.panels), 1)
+
+    def test_fallback(self):
+        """Test the plain text fallback is not remembered, so syntaxes loaded later are found."""
+
+        index = self.highlight.syntax_index
+        self.assertEqual(index.resolve('foo', {}), 'Packages/Text/Plain text.tmLanguage')
+        self.syntaxes['source.foo'] = [mock.Mock(path='Packages/Foo/Foo.sublime-syntax')]
+        self.assertEqual(index.resolve('foo', {}), 'Packages/Foo/Foo.sublime-syntax')
+        self.syntaxes.clear()
+        self.assertEqual(index.resolve('foo', {}), 'Packages/Foo/Foo.sublime-syntax')
+
+    def test_clear(self):
+        """Test clearing the index stops watching the settings."""
+
+        index = self.highlight.syntax_index
+        index.resolve('python', {})
+        self.assertEqual(Settings.listeners, {'mdpopups-syntax-index'})
+        index.clear()
+        self.assertEqual(Settings.listeners, set())
+        index.resolve('python', {})
+        self.assertEqual(Settings.listeners, {'mdpopups-syntax-index'})
+
+    def test_ui_thread(self):
+        """Test calls from other threads are run on the UI thread, which the calling thread waits for."""
+
+        results = []
+
+        def work():
+            results.append(self.highlight.run_on_ui_thread(lambda x: (x, threading.current_thread()), 'a'))
+            try:
+                self.highlight.run_on_ui_thread(lambda: 1 / 0)
+            except ZeroDivisionError as e:
+                results.append(e)
+
+        self.assertEqual(self.highlight.run_on_ui_thread(lambda: 'direct'), 'direct')
+        self.assertEqual(self.scheduled, [])
+        worker = threading.Thread(target=work)
+        worker.start()
+        while worker.is_alive() or self.scheduled:
+            if self.scheduled:
+                self.scheduled.pop(0)()
+            worker.join(0.01)
+        self.assertEqual(results[0], ('a', threading.main_thread()))
+        self.assertIsInstance(results[1], ZeroDivisionError)
+
+    def test_scope_styles(self):
+        """Test scope styles are memoized until the effective scheme style changes."""
+
+        highlighter = self.highlight.SublimeHighlight('scheme')
+        highlighter.view = mock.Mock()
+        highlighter.view.style_for_scope.return_value = {'foreground': '#ff0000', 'bold': True}
+        highlighter.fground = '#000000'
+        for _ in range(2):
+            self.assertEqual(highlighter.get_scope_style('keyword', False), ('#ff0000', None, ['bold']))
+        self.assertEqual(highlighter.view.style_for_scope.call_count, 1)
+
+        view = mock.Mock()
+        view.style.return_value = {'background': '#ffffff'}
+        key = highlighter.sync_style(view)
+        self.assertEqual(highlighter.sync_style(view), key)
+        view.style.return_value = {'background': '#000000'}
+        self.assertNotEqual(highlighter.sync_style(view), key)
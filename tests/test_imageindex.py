@@ -0,0 +1,50 @@
+"""Test the remote image index."""
+import random
+import unittest
+from .util import import_module
+
+imageindex = import_module('imageindex')
+
+PIECES = [
+    '<img src="http://a/{}.png">', "<img alt='x' src='https://b/{}'/>", '<img src="x.png">',
+    '< img src="http://c/{}" >', '<imgx src="http://d">', '<!--', '-->', '<script>', '</script>',
+    '<style a="b">', '</style >', '<p>', 'text', '"', "'", '<', '>', ' ', '\n', '<img', ' src=', '"http://e/{}"'
+]
+
+
+def generate(rand, count):
+    """Generate random HTML."""
+
+    return ''.join(piece.format(rand.randint(0, 5)) for piece in rand.choices(PIECES, k=count))
+
+
+class TestImageIndex(unittest.TestCase):
+    """Test the remote image index."""
+
+    def test_images(self):
+        """Test remote images are found outside of comments, scripts, and styles."""
+
+        text = (
+            '<p><img alt="a" src="http://a/1.png" /></p><!-- <img src="http://b/1.png"> -->\n'
+            '<script><img src="http://c/1.png"></script><img src=\'https://a/2.png?x=1&amp;y=2\'>'
+            '<img src="local.png"><img src="http://a/1.png">'
+        )
+        images = imageindex.ImageIndex(text).images()
+        self.assertEqual(list(images), ['http://a/1.png', 'https://a/2.png?x=1&y=2'])
+        self.assertEqual([text[s:e] for s, e in images['http://a/1.png']], ['http://a/1.png'] * 2)
+        self.assertEqual([text[s:e] for s, e in images['https://a/2.png?x=1&y=2']], ['https://a/2.png?x=1&amp;y=2'])
+
+    def test_update(self):
+        """Test incremental updates give the same index as scanning from scratch."""
+
+        rand = random.Random(0)
+        for _ in range(2000):
+            text = generate(rand, rand.randint(0, 30))
+            index = imageindex.ImageIndex(text)
+            for _ in range(3):
+                start = rand.randint(0, len(text))
+                end = rand.randint(start, min(len(text), start + 20))
+                text = text[:start] + generate(rand, rand.randint(0, 3)) + text[end:]
+                index.update(text)
+                fresh = imageindex.ImageIndex(text)
+                self.assertEqual((index.blocks, index.failures), (fresh.blocks, fresh.failures), text)
@@ -0,0 +1,79 @@
+"""Test image tinting."""
+import io
+import unittest
+from .util import import_module
+
+imagetint = import_module('imagetint')
+png = import_module('png')
+
+
+def make_png(alpha=True, greyscale=False):
+    """Create an image that contains every channel value."""
+
+    planes = (1 if greyscale else 3) + (1 if alpha else 0)
+    rows = []
+    for y in range(16):
+        row = []
+        for x in range(16):
+            value = y * 16 + x
+            pixel = [value] if greyscale else [value, 255 - value, (value * 7) % 256]
+            if alpha:
+                pixel.append((value * 3) % 256)
+            row.extend(pixel)
+        rows.append(row)
+    assert len(rows[0]) == 16 * planes
+    with io.BytesIO() as f:
+        png.Writer(16, 16, alpha=alpha, greyscale=greyscale).write(f, rows)
+        return f.getvalue()
+
+
+class TestTint(unittest.TestCase):
+    """Test that the lookup table tint matches the reference tint."""
+
+    def assert_parity(self, image, color, opacity):
+        """Assert the fast and reference tints are identical."""
+
+        self.assertEqual(
+            imagetint.tint_raw(image, color, opacity),
+            imagetint.tint_raw(image, color, opacity, reference=True),
+            '{} at opacity {}'.format(color, opacity)
+        )
+
+    def test_parity(self):
+        """Test parity across colors and opacities."""
+
+        image = make_png()
+        for color in ('#000000', '#ffffff', '#ff0000', '#3c7a1f', '#12345678', 'hsl(200 50% 40%)'):
+            for opacity in (0, 1, 64, 127, 128, 200, 254, 255):
+                self.assert_parity(image, color, opacity)
+
+    def test_parity_formats(self):
+        """Test parity for images without alpha or in greyscale."""
+
+        for image in (make_png(alpha=False), make_png(greyscale=True), make_png(alpha=False, greyscale=True)):
+            self.assert_parity(image, '#6699cc', 180)
+
+    def test_out_of_gamut(self):
+        """Test that a tint outside of sRGB falls back to the reference tint."""
+
+        self.assertIsNone(imagetint.build_tables('color(display-p3 0 1 0)', 128))
+        self.assert_parity(make_png(), 'color(display-p3 0 1 0)', 128)
+
+
+class TestTintCache(unittest.TestCase):
+    """Test the tinted image cache."""
+
+    def test_cache(self):
+        """Test identical tints are served from the cache."""
+
+        image = make_png()
+        imagetint.tint_cache.clear()
+        html = imagetint.tint(image, '#336699', 128, 16, 16)
+        stats = imagetint.tint_cache.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['memory'], len(html))
+        self.assertIs(imagetint.tint(image, '#336699', 128, 16, 16), html)
+        self.assertEqual(imagetint.tint_cache.stats()['hits'], 1)
+        self.assertIsNot(imagetint.tint(image, '#336699', 128, 16, 32), html)
+        imagetint.tint_cache.clear()
+        self.assertEqual(imagetint.tint_cache.stats()['memory'], 0)
@@ -0,0 +1,178 @@
+"""Test PNG decoding and encoding."""
+import io
+import struct
+from array import array
+import unittest
+import zlib
+from .util import import_module
+
+png = import_module('png')
+
+WIDTH = 13
+HEIGHT = 10
+
+
+def make_png(color_type, trns=None, interlace=False):
+    """Create an 8 bit image of the given color type with rows using every filter type."""
+
+    planes = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[color_type]
+    stride = WIDTH * planes
+    rows = [
+        [(x * 37 + y * 101 + (x * y) % 7) % (16 if color_type == 3 else 256) for x in range(stride)]
+        for y in range(HEIGHT)
+    ]
+
+    if interlace:
+        palette = [(i * 16, 255 - i * 16, i * 8) for i in range(16)] if color_type == 3 else None
+        writer = png.Writer(
+            WIDTH, HEIGHT, greyscale=color_type in (0, 4), alpha=color_type in (4, 6), palette=palette, interlace=True
+        )
+        with io.BytesIO() as f:
+            writer.write(f, rows)
+            return f.getvalue()
+
+    raw = bytearray()
+    previous = [0] * stride
+    for y, row in enumerate(rows):
+        raw.extend(png.filter_scanline(y % 5, row, planes, previous))
+        previous = row
+
+    chunks = [('IHDR', struct.pack('!2I5B', WIDTH, HEIGHT, 8, color_type, 0, 0, 0))]
+    if color_type == 3:
+        chunks.append(('PLTE', bytes(c for i in range(16) for c in (i * 16, 255 - i * 16, i * 8))))
+    if trns is not None:
+        chunks.append(('tRNS', trns))
+    chunks.append(('IDAT', zlib.compress(bytes(raw))))
+    chunks.append(('IEND', b''))
+    with io.BytesIO() as f:
+        png.write_chunks(f, chunks)
+        return f.getvalue()
+
+
+class TestReadRGBA8(unittest.TestCase):
+    """Test decoding straight to a flat RGBA buffer."""
+
+    def assert_rgba8(self, data):
+        """Assert `read_rgba8` matches `asRGBA8`."""
+
+        width, height, pixels, meta = png.Reader(bytes=data).read_rgba8()
+        expected = png.Reader(bytes=data).asRGBA8()
+        self.assertIsInstance(pixels, bytearray)
+        self.assertEqual((width, height), (WIDTH, HEIGHT))
+        self.assertEqual(list(pixels), [v for row in expected[2] for v in row])
+        self.assertEqual(meta['bitdepth'], 8)
+        self.assertTrue(meta['alpha'])
+
+    def test_color_types(self):
+        """Test each color type with every filter."""
+
+        for color_type in (0, 2, 3, 4, 6):
+            self.assert_rgba8(make_png(color_type))
+
+    def test_palette_transparency(self):
+        """Test a palette with partial transparency."""
+
+        self.assert_rgba8(make_png(3, trns=bytes(range(0, 160, 20))))
+
+    def test_fallback(self):
+        """Test images that are decoded by the generic reader."""
+
+        self.assert_rgba8(make_png(2, trns=struct.pack('!3H', 37, 101, 0)))
+        for color_type in (0, 2, 3, 4, 6):
+            self.assert_rgba8(make_png(color_type, interlace=True))
+
+
+class TestWriteBuffer(unittest.TestCase):
+    """Test encoding a flat buffer."""
+
+    def pixels(self, bitdepth, planes, width=WIDTH, height=HEIGHT):
+        """Create a buffer of packed rows and the sample values it holds."""
+
+        samples = [
+            ((x // planes) // 4 * 37 + x % planes * 101 + y // 5 * 7) * (257 if bitdepth == 16 else 1) % (2 ** bitdepth)
+            for y in range(height) for x in range(width * planes)
+        ]
+        if bitdepth == 16:
+            data = struct.pack('!{}H'.format(len(samples)), *samples)
+        elif bitdepth == 8:
+            data = bytes(samples)
+        else:
+            # Pack the samples of each row into bytes, padding the end of the row.
+            per_byte = 8 // bitdepth
+            data = bytearray()
+            for y in range(height):
+                row = samples[y * width * planes:(y + 1) * width * planes]
+                row += [0] * (-len(row) % per_byte)
+                for i in range(0, len(row), per_byte):
+                    value = 0
+                    for sample in row[i:i + per_byte]:
+                        value = (value << bitdepth) | sample
+                    data.append(value)
+        return data, samples
+
+    def assert_round_trip(self, data, samples, planes, **kwargs):
+        """Assert the buffer is written as a PNG that decodes to the given samples."""
+
+        writer = png.Writer(WIDTH, HEIGHT, **kwargs)
+        with io.BytesIO() as f:
+            self.assertEqual(writer.write_buffer(f, data), HEIGHT)
+            result = f.getvalue()
+        width, height, rows, meta = png.Reader(bytes=result).read()
+        self.assertEqual((width, height), (WIDTH, HEIGHT))
+        self.assertEqual(meta['planes'], planes)
+        self.assertEqual(meta['bitdepth'], kwargs.get('bitdepth', 8))
+        self.assertEqual([v for row in rows for v in row], samples)
+        return result
+
+    def test_round_trip(self):
+        """Test 8 and 16 bit RGB and RGBA images at several compression levels."""
+
+        for bitdepth in (8, 16):
+            for alpha in (False, True):
+                planes = 4 if alpha else 3
+                data, samples = self.pixels(bitdepth, planes)
+                sizes = {}
+                for compression in (None, 0, 1, 6, 9):
+                    result = self.assert_round_trip(
+                        data, samples, planes, bitdepth=bitdepth, alpha=alpha, compression=compression
+                    )
+                    sizes[compression] = len(result)
+                    self.assertNotIn(b'tRNS', result)
+                self.assertGreater(sizes[0], sizes[9])
+
+    def test_buffer_types(self):
+        """Test the buffer types that are accepted."""
+
+        data, samples = self.pixels(8, 4)
+        for buffer in (bytes(data), bytearray(data), array('B', data), memoryview(data)):
+            self.assert_round_trip(buffer, samples, 4, alpha=True)
+
+    def test_fallback(self):
+        """Test images that need more processing are written by `write_passes`."""
+
+        for bitdepth in (8, 16):
+            data, samples = self.pixels(bitdepth, 4)
+            self.assert_round_trip(data, samples, 4, alpha=True, bitdepth=bitdepth, interlace=True)
+        data, samples = self.pixels(8, 3)
+        result = self.assert_round_trip(data, samples, 3, gamma=0.45)
+        self.assertIn(b'gAMA', result)
+        result = self.assert_round_trip(data, samples, 3, transparent=(0, 0, 0))
+        self.assertIn(b'tRNS', result)
+        data, samples = self.pixels(4, 1)
+        self.assert_round_trip(data, samples, 1, greyscale=True, bitdepth=4)
+        self.assert_round_trip(data, samples, 1, greyscale=True, bitdepth=4, interlace=True)
+        palette = [(i * 16, 255 - i * 16, i * 8) for i in range(16)]
+        result = self.assert_round_trip(data, samples, 1, palette=palette, bitdepth=4)
+        self.assertIn(b'PLTE', result)
+
+    def test_size(self):
+        """Test a buffer that doesn't match the image size is rejected."""
+
+        data = self.pixels(8, 4)[0]
+        writer = png.Writer(WIDTH, HEIGHT, alpha=True)
+        for buffer in (data[:-1], data + b'\x00', b''):
+            with io.BytesIO() as f:
+                self.assertRaises(ValueError, writer.write_buffer, f, buffer)
+        writer = png.Writer(WIDTH, HEIGHT, greyscale=True, bitdepth=4)
+        with io.BytesIO() as f:
+            self.assertRaises(ValueError, writer.write_buffer, f, bytes(WIDTH * HEIGHT // 2))
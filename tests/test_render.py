@@ -0,0 +1,374 @@
+"""Test rendering content with the package API."""
+import shutil
+import tempfile
+import threading
+import types
+import unittest
+from unittest import mock
+from .util import import_package
+
+
+class Region(object):
+    """Region."""
+
+    def __init__(self, a, b=None):
+        """Initialize."""
+
+        self.a = a
+        self.b = a if b is None else b
+
+    def __eq__(self, rhs):
+        """Check if regions are equal."""
+
+        return (self.a, self.b) == (rhs.a, rhs.b)
+
+
+class Phantom(object):
+    """Phantom."""
+
+    def __init__(self, region, content, layout, on_navigate=None):
+        """Initialize."""
+
+        self.region = region
+        self.content = content
+        self.layout = layout
+        self.on_navigate = on_navigate
+        self.id = None
+
+
+class PhantomSet(object):
+    """Phantom set."""
+
+    def __init__(self, view, key=""):
+        """Initialize."""
+
+        self.view = view
+        self.key = key
+        self.phantoms = []
+
+
+class Settings(dict):
+    """Settings."""
+
+    def add_on_change(self, key, callback):
+        """Add a change listener."""
+
+    def clear_on_change(self, key):
+        """Remove a change listener."""
+
+
+class View(object):
+    """View."""
+
+    def settings(self):
+        """Get the view settings."""
+
+        return Settings()
+
+
+class TestRender(unittest.TestCase):
+    """Base class for tests that import the package with a minimal Sublime Text API."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Import the package."""
+
+        cls.cache = tempfile.mkdtemp()
+        sublime = types.ModuleType('sublime')
+        sublime.Region = Region
+        sublime.Phantom = Phantom
+        sublime.PhantomSet = PhantomSet
+        sublime.load_settings = lambda name: cls.settings
+        sublime.set_timeout = lambda func, delay=0: cls.scheduled.append(func)
+        sublime.cache_path = lambda: cls.cache
+        cls.scheduled = []
+        cls.settings = Settings({'mdpopups.use_sublime_highlighter': False})
+        cls.sublime = sublime
+        cls.mdpopups, cls.patch = import_package({'sublime': sublime, 'sublime_api': types.ModuleType('sublime_api')})
+
+    @classmethod
+    def tearDownClass(cls):
+        """Restore the modules and remove the cache."""
+
+        cls.patch.stop()
+        shutil.rmtree(cls.cache)
+
+
+class TestParserPool(TestRender):
+    """Test pooled Markdown parsers."""
+
+    def setUp(self):
+        """Start with an empty pool."""
+
+        self.mdpopups._clear_parser_pool()
+
+    def pooled(self):
+        """Get the idle parsers of all pool entries."""
+
+        return [p for idle in self.mdpopups._parser_pool.values() for p in idle]
+
+    def test_reuse(self):
+        """Test parsers are reused by renders with the same options."""
+
+        self.assertEqual(self.mdpopups.md2html(View(), '*a*'), '<p><em>a</em></p>')
+        parsers = self.pooled()
+        self.assertEqual(len(parsers), 1)
+        self.assertEqual(self.mdpopups.md2html(View(), '**b**'), '<p><strong>b</strong></p>')
+        self.assertEqual(self.pooled(), parsers)
+
+    def test_options(self):
+        """Test renders with different options get their own parsers."""
+
+        self.mdpopups.md2html(View(), '*a*')
+        self.mdpopups.md2html(View(), '*a*', frontmatter={'allow_code_wrap': True})
+        self.mdpopups.md2html(View(), '*a*', frontmatter={'allow_code_wrap': 1})
+        self.assertEqual(len(self.mdpopups._parser_pool), 3)
+
+    def test_reset(self):
+        """Test state from a previous render does not leak into the next one with a reused parser."""
+
+        fm = {'markdown_extensions': ['markdown.extensions.abbr']}
+        self.assertIn('<abbr', self.mdpopups.md2html(View(), '*[MD]: Markdown\n\nMD', frontmatter=fm))
+        self.assertEqual(self.mdpopups.md2html(View(), 'MD', frontmatter=fm), '<p>MD</p>')
+        self.assertEqual(len(self.pooled()), 1)
+
+    def test_reset_marko(self):
+        """Test link references from a previous render do not leak into the next one with a reused parser."""
+
+        fm = {'markdown_parser': 'marko'}
+        self.assertIn('href', self.mdpopups.md2html(View(), '[a]\n\n[a]: http://example.com', frontmatter=fm))
+        self.assertNotIn('href', self.mdpopups.md2html(View(), '[a]', frontmatter=fm))
+        self.assertEqual(len(self.pooled()), 1)
+
+
+class TestAsync(TestRender):
+    """Test asynchronous rendering."""
+
+    def setUp(self):
+        """Render content as is, once the gate is opened."""
+
+        self.gate = threading.Event()
+        self.gate.set()
+        self.scheduled.clear()
+        patch = mock.patch.object(self.mdpopups, '_create_html', side_effect=self.render)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.view = mock.Mock()
+        self.view.id.return_value = 1
+        self.view.sel.return_value = [mock.Mock(b=0)]
+        self.view.visible_region.return_value = mock.Mock(**{'begin.return_value': 0, 'end.return_value': 10})
+
+    def render(self, view, content, *args, **kwargs):
+        """Render the content."""
+
+        self.gate.wait(5)
+        return content
+
+    def finish(self):
+        """Wait for the pending renders, and run what they scheduled on the UI thread."""
+
+        self.gate.set()
+        self.mdpopups._render_executor.submit(lambda: None).result(5)
+        while self.scheduled:
+            self.scheduled.pop(0)()
+
+    def shown(self, method):
+        """Get the content of the popups shown or updated with the method."""
+
+        return [c[0][0] for c in method.call_args_list]
+
+    def test_supersede(self):
+        """Test a newer popup supersedes a pending one."""
+
+        self.gate.clear()
+        first = self.mdpopups.show_popup_async(self.view, 'first')
+        second = self.mdpopups.show_popup_async(self.view, 'second')
+        self.finish()
+        self.assertEqual(self.shown(self.view.show_popup), ['second'])
+        self.assertTrue(first.is_cancelled())
+        self.assertFalse(first.is_done())
+        self.assertTrue(second.is_done())
+
+    def test_update_supersedes_show(self):
+        """Test an update that supersedes a pending popup shows the popup with the newer content."""
+
+        self.gate.clear()
+        self.mdpopups.show_popup_async(self.view, 'first')
+        self.mdpopups.update_popup_async(self.view, 'second')
+        self.finish()
+        self.assertEqual(self.shown(self.view.show_popup), ['second'])
+        self.assertEqual(self.shown(self.view.update_popup), [])
+
+    def test_update(self):
+        """Test an update of a popup that is already shown."""
+
+        self.mdpopups.show_popup_async(self.view, 'first')
+        self.finish()
+        self.mdpopups.update_popup_async(self.view, 'second')
+        self.finish()
+        self.assertEqual(self.shown(self.view.show_popup), ['first'])
+        self.assertEqual(self.shown(self.view.update_popup), ['second'])
+
+    def test_cancel(self):
+        """Test a cancelled request is not presented."""
+
+        ready = mock.Mock()
+        self.gate.clear()
+        request = self.mdpopups.show_popup_async(self.view, 'first', on_ready=ready)
+        request.cancel()
+        self.finish()
+        self.view.show_popup.assert_not_called()
+        ready.assert_not_called()
+        self.assertFalse(request.is_done())
+
+    def test_order(self):
+        """Test requests without a shared target are all presented in order."""
+
+        ready = mock.Mock()
+        self.view.add_phantom.side_effect = [1, 2, 3]
+        for content in ('a', 'b', 'c'):
+            self.mdpopups.add_phantom_async(self.view, 'key', None, content, 0, on_ready=ready)
+        self.finish()
+        self.assertEqual([c[0][2] for c in self.view.add_phantom.call_args_list], ['a', 'b', 'c'])
+        self.assertEqual([c[0][0] for c in ready.call_args_list], [1, 2, 3])
+
+
+class TestFrontmatter(TestRender):
+    """Test options given as a frontmatter dictionary."""
+
+    def test_dictionary(self):
+        """Test a frontmatter dictionary configures the parser like frontmatter in the content."""
+
+        fm = {'markdown_extensions': ['markdown.extensions.abbr']}
+        content = '*[MD]: Markdown\n\nMD'
+        html = self.mdpopups.md2html(View(), content, frontmatter=fm)
+        self.assertIn('<abbr', html)
+        self.assertEqual(self.mdpopups.md2html(View(), self.mdpopups.format_frontmatter(fm) + content), html)
+
+    def test_override(self):
+        """Test the frontmatter dictionary takes precedence over frontmatter in the content."""
+
+        fm = {'markdown_extensions': ['markdown.extensions.abbr']}
+        content = self.mdpopups.format_frontmatter(fm) + '*[MD]: Markdown\n\nMD'
+        self.assertIn('<abbr', self.mdpopups.md2html(View(), content))
+        self.assertNotIn('<abbr', self.mdpopups.md2html(View(), content, frontmatter={'markdown_extensions': []}))
+
+
+class TestTemplates(TestRender):
+    """Test content templates are compiled once."""
+
+    def setUp(self):
+        """Start with empty caches."""
+
+        self.mdpopups._template_envs.clear()
+        self.mdpopups._template_cache.clear()
+
+    def test_cache(self):
+        """Test the same markup is only compiled once, whatever the template variables."""
+
+        for name in ('a', 'b'):
+            self.assertEqual(
+                self.mdpopups.md2html(View(), '*{{ plugin.name }}*', template_vars={'name': name}),
+                '<p><em>{}</em></p>'.format(name)
+            )
+        stats = self.mdpopups._template_cache.stats()
+        self.assertEqual((stats['size'], stats['hits']), (1, 1))
+
+    def test_options(self):
+        """Test environments are shared by templates with the same options."""
+
+        options = {'variable_start_string': '[[', 'variable_end_string': ']]'}
+        for markup in ('[[ plugin.name ]]', '*[[ plugin.name ]]*'):
+            self.mdpopups.md2html(View(), markup, template_vars={'name': 'a'}, template_env_options=options)
+        self.mdpopups.md2html(View(), '{{ plugin.name }}', template_vars={'name': 'a'})
+        self.assertEqual(len(self.mdpopups._template_envs), 2)
+        self.assertEqual(self.mdpopups._template_cache.stats()['size'], 3)
+
+    def test_compile_template(self):
+        """Test compiled content is rendered with the variables and frontmatter of each render."""
+
+        fm = self.mdpopups.format_frontmatter({'markdown_extensions': ['markdown.extensions.abbr']})
+        template = self.mdpopups.compile_template(fm + '*[MD]: Markdown\n\n{{ plugin.name }}')
+        self.assertIn('<abbr', self.mdpopups.md2html(View(), template, template_vars={'name': 'MD'}))
+        self.assertEqual(self.mdpopups.md2html(View(), template, template_vars={'name': 'mark'}), '<p>mark</p>')
+        self.assertEqual(self.mdpopups._template_cache.stats()['size'], 1)
+
+
+class TestPhantomSet(TestRender):
+    """Test phantom sets only add and erase the phantoms that changed."""
+
+    def setUp(self):
+        """Track the phantoms in the view."""
+
+        self.added = []
+        self.erased = []
+        self.regions = {}
+        for name, func in (
+            ('add_phantom', self.add), ('erase_phantom_by_id', self.erase), ('query_phantoms', self.query)
+        ):
+            patch = mock.patch.object(self.mdpopups, name, side_effect=func)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.phantoms = self.mdpopups.PhantomSet(mock.Mock(), 'key')
+        # Phantom sets erase their phantoms when they are collected, which must not be counted by other tests.
+        self.addCleanup(setattr, self.phantoms, 'phantoms', [])
+
+    def add(self, view, key, region, content, *args, **kwargs):
+        """Add a phantom."""
+
+        self.added.append(content)
+        self.regions[len(self.added)] = region
+        return len(self.added)
+
+    def erase(self, view, pid):
+        """Erase a phantom."""
+
+        self.erased.append(pid)
+
+    def query(self, view, pids):
+        """Get the current regions of the phantoms."""
+
+        return [self.regions.get(pid, Region(-1)) for pid in pids]
+
+    def phantom(self, content, a=0, **kwargs):
+        """Create a phantom."""
+
+        return self.mdpopups.Phantom(Region(a), content, 0, **kwargs)
+
+    def test_update(self):
+        """Test unchanged phantoms are kept and changed ones are replaced."""
+
+        self.phantoms.update([self.phantom('a'), self.phantom('b', 1), self.phantom('c', 2)])
+        self.phantoms.update([self.phantom('a'), self.phantom('B', 1), self.phantom('c', 2, css='.c {}')])
+        self.assertEqual(self.added, ['a', 'b', 'c', 'B', 'c'])
+        self.assertEqual(sorted(self.erased), [2, 3])
+        self.assertEqual([p.id for p in self.phantoms.phantoms], [1, 4, 5])
+
+    def test_duplicates(self):
+        """Test equal phantoms are each matched to one of the current phantoms."""
+
+        self.phantoms.update([self.phantom('a'), self.phantom('a')])
+        self.phantoms.update([self.phantom('a'), self.phantom('a'), self.phantom('a')])
+        self.assertEqual(self.added, ['a', 'a', 'a'])
+        self.assertEqual(self.erased, [])
+        self.assertEqual([p.id for p in self.phantoms.phantoms], [1, 2, 3])
+
+    def test_moved(self):
+        """Test phantoms are matched by their current region, and deleted phantoms are not erased again."""
+
+        self.phantoms.update([self.phantom('a'), self.phantom('b', 1)])
+        self.regions[1] = Region(5)
+        self.regions[2] = Region(-1)
+        self.phantoms.update([self.phantom('a', 5), self.phantom('b', 1)])
+        self.assertEqual(self.added, ['a', 'b', 'b'])
+        self.assertEqual(self.erased, [])
+        self.assertEqual([p.id for p in self.phantoms.phantoms], [1, 3])
+
+    def test_sublime_phantom(self):
+        """Test Sublime phantoms are converted to unchanged plain HTML phantoms."""
+
+        self.phantoms.update([Phantom(Region(0), '<p>a</p>', 0)])
+        self.phantoms.update([Phantom(Region(0), '<p>a</p>', 0)])
+        self.assertEqual(self.added, ['<p>a</p>'])
+        self.assertIsInstance(self.phantoms.phantoms[0], self.mdpopups.Phantom)
+        self.assertFalse(self.phantoms.phantoms[0].md)
@@ -0,0 +1,151 @@
+"""Test the scheme stylesheets."""
+import shutil
+import tempfile
+import types
+import unittest
+from unittest import mock
+from .util import import_package
+
+SCHEME = 'Packages/Test/Test.sublime-color-scheme'
+LIGHT = {'background': '#ffffff', 'foreground': '#000000'}
+DARK = {'background': '#000000', 'foreground': '#ffffff'}
+
+
+class Settings(dict):
+    """Settings."""
+
+    def add_on_change(self, key, callback):
+        """Add a change listener."""
+
+    def clear_on_change(self, key):
+        """Remove a change listener."""
+
+
+class View(object):
+    """View whose effective style can be switched, like a view with the `auto` scheme."""
+
+    def __init__(self):
+        """Initialize."""
+
+        self.scheme = LIGHT
+        self.scopes = []
+
+    def settings(self):
+        """Get the view settings."""
+
+        return Settings()
+
+    def style(self):
+        """Get the general style."""
+
+        return dict(self.scheme)
+
+    def style_for_scope(self, scope):
+        """Get the style of a scope, which is red in the light scheme and green in the dark one."""
+
+        self.scopes.append(scope)
+        return {'foreground': '#ff0000' if self.scheme is LIGHT else '#00ff00'}
+
+
+class TestScheme(unittest.TestCase):
+    """Base class for tests that import the package with a minimal Sublime Text API."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Import the package."""
+
+        cls.cache = tempfile.mkdtemp()
+        sublime = types.ModuleType('sublime')
+        sublime.Phantom = type('Phantom', (object,), {})
+        sublime.PhantomSet = type('PhantomSet', (object,), {})
+        sublime.load_settings = lambda name: Settings()
+        sublime.cache_path = lambda: cls.cache
+        sublime.version = lambda: '4200'
+        sublime.find_resources = lambda name: []
+        sublime.load_binary_resource = lambda name: b''
+        mdpopups, cls.patch = import_package({'sublime': sublime, 'sublime_api': types.ModuleType('sublime_api')})
+        cls.st = mdpopups.st_scheme_template
+
+    @classmethod
+    def tearDownClass(cls):
+        """Restore the modules and remove the cache."""
+
+        cls.patch.stop()
+        shutil.rmtree(cls.cache)
+
+    def setUp(self):
+        """Start with empty caches."""
+
+        self.st.get_css_disk_cache().clear()
+        self.st.get_template_bytecode_cache().clear()
+        self.view = View()
+        self.template = self.st.SchemeTemplate(SCHEME)
+
+    def apply(self, css, template=None, **kwargs):
+        """Apply the template to the CSS."""
+
+        return (template or self.template).apply_template(self.view, css, self.st.POPUP, **kwargs)
+
+
+class TestStyleCache(TestScheme):
+    """Test rendered stylesheets and compiled templates are reused."""
+
+    CSS = '.a { {{ "keyword"|css }} }'
+
+    def test_hit(self):
+        """Test the same stylesheet is only rendered once."""
+
+        self.assertEqual(self.apply(self.CSS), '.a { color: #ff0000; }')
+        with mock.patch.object(self.template, 'get_template', side_effect=AssertionError):
+            self.assertEqual(self.apply(self.CSS), '.a { color: #ff0000; }')
+        self.assertEqual(self.template.style_cache.stats()['hits'], 1)
+
+    def test_style_change(self):
+        """Test a change of the effective style is not served from the cache."""
+
+        self.assertEqual(self.apply(self.CSS), '.a { color: #ff0000; }')
+        self.view.scheme = DARK
+        self.assertEqual(self.apply(self.CSS), '.a { color: #00ff00; }')
+        self.view.scheme = LIGHT
+        self.assertEqual(self.apply(self.CSS), '.a { color: #ff0000; }')
+
+    def test_disk(self):
+        """Test stylesheets are loaded from disk by new scheme objects."""
+
+        self.assertEqual(self.apply(self.CSS), '.a { color: #ff0000; }')
+        template = self.st.SchemeTemplate(SCHEME)
+        with mock.patch.object(template, 'get_template', side_effect=AssertionError):
+            self.assertEqual(self.apply(self.CSS, template), '.a { color: #ff0000; }')
+        self.view.scheme = DARK
+        self.assertEqual(self.apply(self.CSS, template), '.a { color: #00ff00; }')
+
+    def test_plugin_vars(self):
+        """Test the compiled template is reused for different template variables, which are not persisted."""
+
+        css = '.a { color: {{ plugin.color }}; }'
+        self.assertEqual(self.apply(css, template_vars={'color': 'red'}), '.a { color: red; }')
+        self.assertEqual(self.apply(css, template_vars={'color': 'blue'}), '.a { color: blue; }')
+        self.assertEqual(self.template.template_cache.stats()['hits'], 1)
+        self.assertEqual(self.st.get_css_disk_cache().stats()['size'], 0)
+
+
+class TestScopeStyles(TestScheme):
+    """Test scope styles are memoized for the effective scheme style."""
+
+    def test_memo(self):
+        """Test each scope is only looked up once."""
+
+        self.template.prefetch_scopes(self.view, ['.keyword', 'string'])
+        for _ in range(2):
+            self.assertEqual(self.template.guess_style(self.view, 'keyword')['foreground'], '#ff0000')
+            self.assertEqual(self.template.guess_style(self.view, '.string')['foreground'], '#ff0000')
+        self.assertEqual(self.view.scopes, ['keyword', 'string'])
+
+    def test_style_change(self):
+        """Test scopes are looked up again when the effective style changes."""
+
+        self.assertEqual(self.template.guess_style(self.view, 'keyword')['background'], '#ffffff')
+        self.view.scheme = DARK
+        style = self.template.guess_style(self.view, 'keyword')
+        self.assertEqual((style['foreground'], style['background']), ('#00ff00', '#000000'))
+        self.assertEqual(self.view.scopes, ['keyword', 'keyword'])
@@ -0,0 +1,40 @@
+"""
+Test utilities.
+
+`mdpopups/__init__.py` requires the Sublime Text API, so modules that do not
+depend on it are imported without executing the package's `__init__`.
+"""
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+import sys
+from unittest import mock
+
+PACKAGE = 'mdpopups'
+PACKAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), PACKAGE)
+
+
+def import_module(name):
+    """Import a module from `mdpopups` without importing the Sublime Text API."""
+
+    if PACKAGE not in sys.modules:
+        spec = importlib.machinery.ModuleSpec(PACKAGE, None, is_package=True)
+        spec.submodule_search_locations = [PACKAGE_PATH]
+        sys.modules[PACKAGE] = importlib.util.module_from_spec(spec)
+    return importlib.import_module('{}.{}'.format(PACKAGE, name))
+
+
+def import_package(modules):
+    """
+    Import `mdpopups` itself with stand-ins for the Sublime Text API.
+
+    `modules` maps the names of the API modules (`sublime` and `sublime_api`) to the stand-ins. A fresh copy of
+    the package is imported, and it and the stand-ins stay in `sys.modules` until the returned patch is stopped.
+    """
+
+    patch = mock.patch.dict(sys.modules, modules)
+    patch.start()
+    for name in [n for n in sys.modules if n == PACKAGE or n.startswith(PACKAGE + '.')]:
+        del sys.modules[name]
+    return importlib.import_module(PACKAGE), patch